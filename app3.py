@@ -5,8 +5,9 @@ import hashlib
 from dotenv import load_dotenv
 from openai import OpenAI, OpenAIError
 import gradio as gr
-from collections import deque
 import tiktoken  # for rough token estimation
+from token_history import TokenHistory, REPLY_PRIMING_TOKENS, MESSAGE_OVERHEAD_TOKENS
+from context_window import plan_context, TRUNCATE
 
 # Load environment variables
 load_dotenv()
@@ -23,7 +24,7 @@ with open("valid_users.json", "r") as f:
 # Configs
 SECRET_KEY = b""
 MAX_TOKENS = 128_000
-DROP_BATCH_K = 3
+REPLY_MAX_TOKENS = 500
 
 # Session store
 user_histories = {}
@@ -52,12 +53,11 @@ Discuss harmful effects – When discussing substances like Shilajit or Ashwagan
 def generate_hmac(user_id: str) -> str:
     return hmac.new(SECRET_KEY, user_id.encode(), hashlib.sha256).hexdigest()
 
-# Estimate tokens using tokenizer
-def estimate_tokens(messages):
-    total_tokens = 0
-    for msg in messages:
-        total_tokens += len(encoding.encode(msg["content"]))
-    return total_tokens
+# Count tokens using tokenizer
+def count_tokens(text):
+    return len(encoding.encode(text))
+
+SYSTEM_TOKENS = MESSAGE_OVERHEAD_TOKENS + count_tokens(SYSTEM_MESSAGE)
 
 # Main chatbot function
 def chatbot(user_id: str, token: str, user_input: str) -> str:
@@ -67,35 +67,37 @@ def chatbot(user_id: str, token: str, user_input: str) -> str:
         return "❌ Invalid user ID or token."
 
     # Get or initialize user's chat history
-    history = user_histories.setdefault(user_id, deque())
+    history = user_histories.get(user_id)
+    if history is None:
+        history = user_histories[user_id] = TokenHistory(count_tokens)
     # Log current queue state
     message_count = len(history)
-    tokens_estimate = estimate_tokens([{"role": "system", "content": SYSTEM_MESSAGE}] + list(history))
+    tokens_estimate = REPLY_PRIMING_TOKENS + SYSTEM_TOKENS + history.total
     print(f"[INFO] Queue retrieved for '{user_id}' – messages in queue: {message_count}, estimated tokens: {tokens_estimate}")
 
 
 # Add new user input to history
     history.append({"role": "user", "content": user_input})
 
+    # Drop the oldest messages that no longer fit, keeping room for the reply
+    plan = plan_context(history, REPLY_PRIMING_TOKENS + SYSTEM_TOKENS, MAX_TOKENS - REPLY_MAX_TOKENS, TRUNCATE)
+    if plan.start is None:
+        history.pop()
+        return "⚠️ Your message is too long. Please shorten it and try again."
+    for _ in range(plan.dropped):
+        history.popleft()
+
     # Construct full message list including system prompt
     messages = [{"role": "system", "content": SYSTEM_MESSAGE}]
     messages.extend(history)
 
-    # Check token limit and drop oldest messages if necessary
-    while estimate_tokens(messages) > MAX_TOKENS and len(history) > 0:
-        for _ in range(DROP_BATCH_K):
-            if history:
-                history.popleft()
-        messages = [{"role": "system", "content": SYSTEM_MESSAGE}]
-        messages.extend(history)
-
     try:
         # Call OpenAI
         response = client.chat.completions.create(
             model="ft:gpt-4o-mini-2024-07-18:curiosity:finalrebel:BQdAfbs2",
             messages=messages,
             temperature=0.7,
-            max_tokens=500,
+            max_tokens=REPLY_MAX_TOKENS,
         )
         assistant_reply = response.choices[0].message.content
 
@@ -0,0 +1,225 @@
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+### ---- Index Config ---- ###
+VERIFIED_CACHE_SIZE = 50_000    # (user_id, token) pairs remembered after a good HMAC check
+VERSION_CHECK_INTERVAL = 1.0    # seconds between checks of the store's version
+NEAR_QUOTA_RATIO = 0.9          # used_tokens / usage_quota at which a user counts as near quota
+
+
+### ---- Aggregates ---- ###
+class UserStats:
+    """Dashboard totals over non-admin users, kept current by adding and
+    removing single records rather than rescanning the table."""
+
+    def __init__(self, default_usage_quota, near_quota_ratio=NEAR_QUOTA_RATIO):
+        self.default_usage_quota = default_usage_quota
+        self.near_quota_ratio = near_quota_ratio
+        self.users = 0
+        self.active = 0
+        self.used_tokens = 0
+        self.near_quota = 0
+
+    def _apply(self, record, sign):
+        if record.get("role") == "admin":
+            return
+        used = record.get("used_tokens", 0)
+        self.users += sign
+        self.active += sign * bool(record.get("active", True))
+        self.used_tokens += sign * used
+        quota = record.get("usage_quota", self.default_usage_quota)  # 0 = unlimited
+        self.near_quota += sign * bool(quota and used >= self.near_quota_ratio * quota)
+
+    def add(self, record):
+        self._apply(record, 1)
+
+    def remove(self, record):
+        self._apply(record, -1)
+
+    def as_dict(self):
+        return {
+            "users": self.users,
+            "active_users": self.active,
+            "total_used_tokens": self.used_tokens,
+            "users_near_quota": self.near_quota,
+        }
+
+
+### ---- User Index ---- ###
+class UserIndex:
+    """In-memory view of the user store for validate_user and route().
+
+    Readers only ever see a complete snapshot dict: reloads build a new one
+    and swap the reference, so lookups take no lock and never observe a
+    half-loaded table. The store's version (file mtime, or a counter bumped on
+    every record change) is polled at most every `check_interval` seconds, by
+    refresh() or by the thread start() runs. Stores with changes_since() only
+    send the rows written since the last check; others are reloaded whole.
+    With preload=False the table is read on first lookup (or ensure_loaded())
+    instead of in the constructor."""
+
+    def __init__(self, store, sign, default_usage_quota, verified_size=VERIFIED_CACHE_SIZE,
+                 check_interval=VERSION_CHECK_INTERVAL, preload=True):
+        self._store = store
+        self._sign = sign
+        self.default_usage_quota = default_usage_quota
+        self.verified_size = verified_size
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._verified_lock = threading.Lock()
+        self._verified = OrderedDict()
+        self._snapshot = {}
+        self._stats_lock = threading.Lock()
+        self._stats = UserStats(default_usage_quota)
+        self._version = None
+        self._checked = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.reloads = 0
+        self.updates = 0
+        self.verify_hits = 0
+        self.verify_misses = 0
+        if preload:
+            self.reload()
+
+    ### ---- Snapshots ---- ###
+    def snapshot(self):
+        return self._snapshot if self.reloads else self.ensure_loaded()
+
+    def get(self, user_id, default=None):
+        return self.snapshot().get(user_id, default)
+
+    def __getitem__(self, user_id):
+        return self.snapshot()[user_id]
+
+    def __contains__(self, user_id):
+        return user_id in self.snapshot()
+
+    def __len__(self):
+        return len(self.snapshot())
+
+    def items(self):
+        return self.snapshot().items()
+
+    ### ---- Reloading ---- ###
+    @property
+    def loaded(self):
+        return bool(self.reloads)
+
+    def ensure_loaded(self):
+        self.reload(initial=True)
+        return self._snapshot
+
+    def reload(self, initial=False):
+        with self._reload_lock:
+            if initial and self.reloads:
+                return  # someone else loaded it while we waited
+            version = self._store.version()
+            snapshot = self._store.load_all()
+            stats = UserStats(self.default_usage_quota)
+            for record in snapshot.values():
+                stats.add(record)
+            with self._stats_lock:
+                self._snapshot = snapshot
+                self._stats = stats
+            self._version = version
+            self._checked = time.monotonic()
+            self.reloads += 1
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        if self._store.version() == self._version:
+            return False
+        if self.loaded and hasattr(self._store, "changes_since"):
+            self._apply_changes()
+        else:
+            self.reload()
+        return True
+
+    def _apply_changes(self):
+        with self._reload_lock:
+            version, changed = self._store.changes_since(self._version)
+            with self._stats_lock:
+                snapshot = self._snapshot
+                if any(user_id not in snapshot for user_id in changed):
+                    snapshot = dict(snapshot)  # new users: copy, so iterating readers never see it grow
+                for user_id, record in changed.items():
+                    old = snapshot.get(user_id)
+                    if old is not None:
+                        self._stats.remove(old)
+                    snapshot[user_id] = record
+                    self._stats.add(record)
+                self._snapshot = snapshot
+            self._version = version
+            self.updates += len(changed)
+
+    def start(self):
+        # Polls the store in the background, so request handlers never wait on a refresh
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="user-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            if not self.loaded:
+                continue  # the first load is left to ensure_loaded() or the first lookup
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                print(f"⚠️ User index refresh failed, will retry: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def update_record(self, user_id, **fields):
+        # Apply a change already written to the store to the live record and the totals
+        with self._stats_lock:
+            record = self._snapshot.get(user_id)
+            if record is None:
+                return None
+            self._stats.remove(record)
+            record.update(fields)
+            self._stats.add(record)
+            return record
+
+    def user_stats(self):
+        with self._stats_lock:
+            return self._stats.as_dict()
+
+    ### ---- Credentials ---- ###
+    def verify(self, user_id, token):
+        key = (user_id, token)
+        with self._verified_lock:
+            if key in self._verified:
+                self._verified.move_to_end(key)
+                self.verify_hits += 1
+                return True
+            self.verify_misses += 1
+
+        if not hmac.compare_digest(self._sign(user_id), token):
+            return False
+
+        with self._verified_lock:
+            self._verified[key] = True
+            while len(self._verified) > self.verified_size:
+                self._verified.popitem(last=False)
+        return True
+
+    def stats(self):
+        return {
+            "users": len(self._snapshot),
+            "reloads": self.reloads,
+            "updated_records": self.updates,
+            "verified_cached": len(self._verified),
+            "verify_hits": self.verify_hits,
+            "verify_misses": self.verify_misses,
+        }
@@ -0,0 +1,209 @@
+# batch_eval.py
+#
+# Runs a JSONL file of prompts through the model without the Gradio UI, using
+# the same system prompt and message building as chat(). One JSON object per
+# input line:
+#
+#   {"id": "ashwagandha-1", "prompt": "Does ashwagandha work?", "history": [{"role": "user", "content": "..."}, ...]}
+#
+# "id" defaults to the line number and "history" (earlier turns) is optional.
+# Results are appended to the output JSONL as they finish; rerunning with the
+# same output skips every item that already has a reply.
+#
+#   python batch_eval.py prompts.jsonl --output results.jsonl --concurrency 16
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import time
+
+from context_window import CONTEXT_POLICIES, TRUNCATE, COMPACT
+from history_digest import ExtractiveDigest, ModelDigest, compact_history, compaction_thresholds
+from prompts import SYSTEM_MESSAGE, MODEL, TEMPERATURE, REPLY_MAX_TOKENS, prepare_turn
+from scheduler import Scheduler
+from startup import load_encoding
+from upstream import Upstream, UpstreamError, parse_keys, MAX_ATTEMPTS
+from token_history import TokenHistory, MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS
+
+# ---- Config ---- #
+DEFAULT_MAX_TOKENS = 128_000
+PROGRESS_EVERY = 100
+
+
+# ---- Input / Checkpoint ---- #
+def read_items(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(line_no))
+            yield item
+
+
+def load_completed(path):
+    # Ids that already have a reply; failed items are tried again
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            if "reply" in record:
+                done.add(str(record["id"]))
+    return done
+
+
+class ResultWriter:
+    """Appends one JSON line per finished item and flushes it straight away."""
+
+    def __init__(self, path):
+        self._file = open(path, "a+", encoding="utf-8")
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")  # start clean after a torn line
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# ---- Workers ---- #
+class BatchStats:
+    def __init__(self):
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.start = time.perf_counter()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        return (f"{self.done} done, {self.failed} failed, {self.skipped} skipped in {elapsed:.1f}s "
+                f"({rate:.2f} items/s), tokens: {self.prompt_tokens} prompt + {self.completion_tokens} completion")
+
+
+async def evaluate(item, args, upstream, scheduler, count_tokens, system_tokens, summarize):
+    history = TokenHistory(count_tokens, item.get("history") or ())
+    prompt = item.get("prompt") or item.get("input") or ""
+    record = {"id": item["id"], "prompt": prompt}
+    ticket = scheduler.ticket(item["id"])
+    try:
+        if args.policy == COMPACT:
+            available = args.max_tokens - REPLY_MAX_TOKENS - REPLY_PRIMING_TOKENS - system_tokens
+            thresholds = compaction_thresholds(available)
+            if thresholds is not None:
+                # The digest request is admitted through the rate limits like the reply
+                await compact_history(history, functools.partial(summarize, admit=ticket.wait_admission), *thresholds)
+        messages, prompt_tokens = prepare_turn(history, prompt, system_tokens, args.max_tokens, args.policy)
+        if messages is None:
+            record["error"] = f"prompt needs {prompt_tokens} tokens, over the {args.max_tokens} limit"
+            return record
+        await ticket.wait_admission(prompt_tokens + REPLY_MAX_TOKENS)
+    finally:
+        ticket.release()
+
+    start = time.perf_counter()
+    try:
+        response = await upstream.complete(
+            model=args.model,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=REPLY_MAX_TOKENS,
+        )
+    except UpstreamError as e:
+        record["error"] = f"{e.kind}: {e.__cause__ or e}"
+        return record
+
+    record["reply"] = response.choices[0].message.content
+    record["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    record["sent_messages"] = len(messages) - 1
+    if response.usage is not None:
+        record["usage"] = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+        }
+    return record
+
+
+async def run(args):
+    encoding = load_encoding()
+
+    def count_tokens(text):
+        return len(encoding.encode(text))
+
+    system_tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(SYSTEM_MESSAGE["content"])
+    upstream = Upstream(parse_keys(os.environ["APIK"]), max_attempts=args.attempts)
+    scheduler = Scheduler(rpm=args.rpm, tpm=args.tpm)
+    summarize = ModelDigest(upstream, count_tokens, fallback=ExtractiveDigest(count_tokens))
+    completed = load_completed(args.output)
+    writer = ResultWriter(args.output)
+    stats = BatchStats()
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)  # bounded, so the input is streamed
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            record = await evaluate(item, args, upstream, scheduler, count_tokens, system_tokens, summarize)
+            writer.write(record)
+            if "error" in record:
+                stats.failed += 1
+            else:
+                stats.done += 1
+                usage = record.get("usage") or {}
+                stats.prompt_tokens += usage.get("prompt_tokens", 0)
+                stats.completion_tokens += usage.get("completion_tokens", 0)
+            if (stats.done + stats.failed) % PROGRESS_EVERY == 0:
+                print(f"… {stats.report()}")
+
+    workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+    try:
+        queued = 0
+        for item in read_items(args.input):
+            if str(item["id"]) in completed:
+                stats.skipped += 1
+                continue
+            if args.limit and queued >= args.limit:
+                break
+            await queue.put(item)
+            queued += 1
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        writer.close()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the chat model")
+    parser.add_argument("input", help="JSONL file with one prompt per line")
+    parser.add_argument("--output", default="batch-results.jsonl", help="results JSONL, also the resume checkpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help="context budget per request")
+    parser.add_argument("--policy", choices=CONTEXT_POLICIES, default=TRUNCATE, help="what to do when history does not fit")
+    parser.add_argument("--rpm", type=int, default=0, help="requests/minute limit (0 = off)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens/minute limit (0 = off)")
+    parser.add_argument("--attempts", type=int, default=MAX_ATTEMPTS, help="tries per item on 429/5xx errors and timeouts")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many new items (0 = all)")
+    args = parser.parse_args()
+
+    stats = asyncio.run(run(args))
+    print(f"✅ {stats.report()}")
+    print(f"   results saved to {args.output}")
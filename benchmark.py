@@ -0,0 +1,319 @@
+# benchmark.py
+#
+# Load test for chatbot-server.py against a local fake OpenAI endpoint.
+# Drives N simulated users through route() and chat() concurrently and saves
+# the results as JSON so runs can be compared for regressions:
+#
+#   python benchmark.py --users 50 --turns 5 --history 200 --output run.json
+#   python benchmark.py --users 50 --turns 5 --history 200 --compare run.json
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fake_openai import FakeConfig, start_fake_openai
+
+# ---- Config ---- #
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_FILE = os.path.join(REPO_DIR, "chatbot-server.py")
+PROMPTS = [
+    "Does ashwagandha work?",
+    "Is shilajit safe?",
+    "Can homeopathy cure a cold?",
+    "Do crystals have healing energy?",
+    "Is it true that we only use 10% of our brain?",
+    "Does detox tea remove toxins?",
+]
+FILLER = "Let us think about what evidence would change our minds about this claim. "
+# Metrics where a higher value in the new run is a regression
+REGRESSION_METRICS = [
+    ("startup", "import_seconds"),
+    ("latency_ms", "p50"),
+    ("latency_ms", "p95"),
+    ("latency_ms", "p99"),
+    ("tokenizer", "cpu_ms_per_turn"),
+    ("io", "transcript_bytes_per_turn"),
+    ("io", "store_and_other_bytes_per_turn"),
+    ("memory", "rss_growth_bytes"),
+]
+
+
+# ---- Measurement Helpers ---- #
+class TimedEncoding:
+    """Wraps the tiktoken encoding to add up the CPU time spent in encode()."""
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+        self.cpu_seconds = 0.0
+        self.calls = 0
+
+    def encode(self, text, *args, **kwargs):
+        start = time.thread_time()
+        tokens = self._encoding.encode(text, *args, **kwargs)
+        self.cpu_seconds += time.thread_time() - start
+        self.calls += 1
+        return tokens
+
+    def __getattr__(self, name):
+        return getattr(self._encoding, name)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def written_bytes():
+    # Bytes passed to write() by this process, where the platform reports it
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def load_server():
+    sys.path.insert(0, REPO_DIR)
+    spec = importlib.util.spec_from_file_location("chatbot_server", SERVER_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["chatbot_server"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---- Load Generation ---- #
+def provision(server, users, history_len):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = {
+        f"bench-user-{i:05d}": {
+            "token": server.generate_hmac(f"bench-user-{i:05d}"),
+            "role": "user",
+            "active": True,
+            "used_tokens": 0,
+            "max_tokens": server.DEFAULT_MAX_TOKENS,
+            "createdDate": now,
+        }
+        for i in range(users)
+    }
+    server.STORE.insert_many(records)
+    server.USERS.reload()
+
+    for uid in records:
+        server.TRANSCRIPTS.append(uid, [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"{PROMPTS[i % len(PROMPTS)]} {FILLER * 3}"}
+            for i in range(history_len)
+        ])
+    server.TRANSCRIPTS.flush()
+    return {uid: record["token"] for uid, record in records.items()}
+
+
+async def simulate_user(server, uid, token, turns, latencies, errors):
+    login = await asyncio.to_thread(server.route, uid, token)
+    chat_state = login[-2]
+    for turn in range(turns):
+        prompt = PROMPTS[(hash(uid) + turn) % len(PROMPTS)]
+        start = time.perf_counter()
+        last = None
+        async for last in server.chat(prompt, uid, token, chat_state):
+            pass
+        latencies.append(time.perf_counter() - start)
+        if last is None or last[1]:
+            errors.append(last[1] if last else "no output")
+        else:
+            chat_state = last[2]
+
+
+async def drive(server, credentials, turns, concurrency):
+    latencies, errors = [], []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(uid, token):
+        async with gate:
+            await simulate_user(server, uid, token, turns, latencies, errors)
+
+    await asyncio.gather(*(one(uid, token) for uid, token in credentials.items()))
+    return latencies, errors
+
+
+# ---- Reporting ---- #
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'metric':<45}{'baseline':>14}{'current':>14}{'change':>10}")
+    for section, key in REGRESSION_METRICS:
+        old = (baseline.get(section) or {}).get(key)
+        new = (results.get(section) or {}).get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        flag = " ⚠️" if change > tolerance else ""
+        print(f"{section + '.' + key:<45}{old:>14.2f}{new:>14.2f}{change:>+10.1%}{flag}")
+        if change > tolerance:
+            regressions.append(f"{section}.{key}")
+    return regressions
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="skeptic-bench-")
+    os.chdir(workdir)
+
+    fake_cfg = FakeConfig(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate, seed=args.seed,
+                          slow_rate=args.slow_rate)
+    fake_server, base_url = start_fake_openai(fake_cfg)
+    os.environ.update({
+        "APIK": "sk-bench",
+        "SECT": "bench-secret",
+        "OPENAI_BASE_URL": base_url,
+        "USER_STORE": f"{args.user_store}:{'users.db' if args.user_store == 'sqlite' else 'config.json'}",
+        "REPLY_CACHE": "on" if args.reply_cache else "off",
+        "OPENAI_RPM": str(args.rpm),
+        "OPENAI_TPM": str(args.tpm),
+        "OPENAI_HEDGE_AFTER": str(args.hedge_after),
+    })
+
+    import_start = time.perf_counter()
+    server = load_server()
+    import_seconds = time.perf_counter() - import_start
+
+    timed_encoding = TimedEncoding(server.get_encoding())
+    server.encoding = timed_encoding
+    credentials = provision(server, args.users, args.history)
+
+    rss_before = rss_bytes()
+    written_before = written_bytes()
+    transcripts_before = dir_size(server.CHAT_DIR)
+    tokenizer_before = timed_encoding.cpu_seconds
+
+    wall_start = time.perf_counter()
+    latencies, errors = asyncio.run(drive(server, credentials, args.turns, args.concurrency))
+    wall = time.perf_counter() - wall_start
+
+    server.TRANSCRIPTS.flush()
+    turns = len(latencies)
+    transcript_bytes = dir_size(server.CHAT_DIR) - transcripts_before
+    written = written_bytes()
+    total_written = written - written_before if written is not None and written_before is not None else None
+    lat_ms = sorted(x * 1000 for x in latencies)
+    tokenizer_cpu = timed_encoding.cpu_seconds - tokenizer_before
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "users": args.users,
+            "turns": args.turns,
+            "history": args.history,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "token_delay": args.token_delay,
+            "error_rate": args.error_rate,
+            "slow_rate": args.slow_rate,
+            "hedge_after": args.hedge_after,
+            "user_store": args.user_store,
+            "reply_cache": args.reply_cache,
+            "rpm": args.rpm,
+            "tpm": args.tpm,
+        },
+        "startup": {"import_seconds": import_seconds, "phases": server.STARTUP.report()["phases"]},
+        "turns": turns,
+        "errors": len(errors),
+        "wall_seconds": wall,
+        "throughput_turns_per_s": turns / wall if wall else 0.0,
+        "latency_ms": {
+            "p50": percentile(lat_ms, 50),
+            "p95": percentile(lat_ms, 95),
+            "p99": percentile(lat_ms, 99),
+            "mean": sum(lat_ms) / turns if turns else 0.0,
+            "max": lat_ms[-1] if lat_ms else 0.0,
+        },
+        "tokenizer": {
+            "cpu_seconds": tokenizer_cpu,
+            "cpu_ms_per_turn": tokenizer_cpu * 1000 / turns if turns else 0.0,
+            "encode_calls": timed_encoding.calls,
+        },
+        "io": {
+            "transcript_bytes_per_turn": transcript_bytes / turns if turns else 0.0,
+            # Everything else the process wrote: user store, reply cache, logs
+            "store_and_other_bytes_per_turn": (total_written - transcript_bytes) / turns if turns and total_written is not None else None,
+        },
+        "memory": {
+            "rss_growth_bytes": rss_bytes() - rss_before,
+            "session_state": server.SESSION_STATE.stats(),
+        },
+        "scheduler": server.SCHEDULER.stats(),
+        "upstream": {"requests": fake_cfg.requests, "injected_errors": fake_cfg.errors, "client": server.UPSTREAM.stats()},
+    }
+    fake_server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test chatbot-server.py against a fake OpenAI endpoint")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per user")
+    parser.add_argument("--history", type=int, default=50, help="messages pre-loaded into each transcript")
+    parser.add_argument("--concurrency", type=int, default=20, help="users active at the same time")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake endpoint time to first byte (s)")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="fake endpoint delay per streamed chunk (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of fake requests that stall for 1s")
+    parser.add_argument("--hedge-after", type=float, default=0.0, help="server hedges requests slower than this (s, 0 = off)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--user-store", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--reply-cache", action="store_true")
+    parser.add_argument("--rpm", type=int, default=0, help="scheduler requests/minute limit (0 = off)")
+    parser.add_argument("--tpm", type=int, default=0, help="scheduler tokens/minute limit (0 = off)")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    lat = results["latency_ms"]
+    print(f"✅ {results['turns']} turns, {results['errors']} errors, {results['throughput_turns_per_s']:.1f} turns/s")
+    print(f"   latency p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms")
+    print(f"   tokenizer {results['tokenizer']['cpu_ms_per_turn']:.2f}ms CPU/turn, results saved to {args.output}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
@@ -1,169 +1,498 @@
-import json
 import hmac
 import hashlib
 import os
-from collections import deque
+import asyncio
+import atexit
+import functools
+import threading
+import time
+from startup import StartupProfiler, load_encoding, require_tokenizer_cache
+STARTUP = StartupProfiler(budget=float(os.environ.get("STARTUP_BUDGET", "0")))  # seconds until the port is bound
 import gradio as gr
-from openai import OpenAI, OpenAIError
-import tiktoken
-from filelock import FileLock
 from datetime import datetime
+from token_history import TokenHistory, REPLY_PRIMING_TOKENS, MESSAGE_OVERHEAD_TOKENS
+from user_store import open_user_store, UserQuery, SORT_FIELDS
+from auth_index import UserIndex
+from transcripts import TranscriptStore
+from context_window import normalize_policy, COMPACT
+from prompts import SYSTEM_MESSAGE, MODEL, TEMPERATURE, REPLY_MAX_TOKENS, SAMPLING_PARAMS, prepare_turn
+from reply_cache import ReplyCache, cache_key
+from sessions import SessionManager, SESSION_MEMORY_BUDGET, SESSION_HOT_LIMIT, SESSION_IDLE_SECONDS
+from metrics import Metrics, start_metrics_server, METRICS_PORT, METRICS_HOST
+from scheduler import Scheduler, SingleFlight, STATUS_INTERVAL, DEFAULT_RPM, DEFAULT_TPM
+from usage import UsageLedger, USAGE_FILE
+from state_backend import open_state_backend
+from transcript_search import TranscriptIndex, SEARCH_FILE, SEARCH_PAGE_SIZE
+from upstream import Upstream, UpstreamError, CircuitBreaker, parse_keys, MAX_ATTEMPTS, REQUEST_TIMEOUT, BREAKER_THRESHOLD
+from history_digest import (ExtractiveDigest, ModelDigest, compact_history, compaction_point, compaction_thresholds,
+                            COMPACT_AT_TOKENS, COMPACT_KEEP_TOKENS, DIGEST_MODEL)
+STARTUP.mark("imports")
+require_tokenizer_cache()  # refuse to start rather than fetch BPE files on the first chat
 
 ### ---- File Constants ---- ###
-API_KEY_FILE = "api-key.json"
-CONFIG_FILE = "config.json"
-SECRET_KEY_FILE = "secret-key.json"
 CHAT_DIR = "chats"
+REPLY_CACHE_FILE = "reply-cache.db"
 
 ### ---- Load Secrets ---- ###
 
-OPENAI_API_KEY = os.environ["APIK"]
+OPENAI_API_KEYS = parse_keys(os.environ["APIK"])  # comma-separated keys are used in rotation
 SECRET_KEY = os.environ["SECT"].encode("utf-8")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+UPSTREAM = Upstream(  # retries, timeouts, circuit breaker and hedging; clients are created on first use
+    OPENAI_API_KEYS,
+    max_attempts=int(os.environ.get("OPENAI_MAX_ATTEMPTS", MAX_ATTEMPTS)),
+    request_timeout=float(os.environ.get("OPENAI_TIMEOUT", REQUEST_TIMEOUT)),
+    hedge_after=float(os.environ.get("OPENAI_HEDGE_AFTER", "0")),
+    breaker=CircuitBreaker(threshold=int(os.environ.get("OPENAI_BREAKER_THRESHOLD", BREAKER_THRESHOLD))),
+)
+
+METRICS = Metrics(enabled=os.environ.get("METRICS", "on") != "off")
 
 ### ---- Load User Config ---- ###
-def load_users():
-    with open(CONFIG_FILE, "r") as f:
-        return json.load(f)
+STORE = open_user_store()  # backend picked by USER_STORE, see user_store.py
+if hasattr(STORE, "lock"):
+    STORE.lock = METRICS.timed_lock(STORE.lock, "user_store")
 
-def save_users(data):
-    with FileLock(CONFIG_FILE + ".lock"):
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(data, f, indent=2)
+STATE = open_state_backend(STORE)  # "shared" when several worker processes serve traffic, see launcher.py
+STARTUP.mark("user_store")
 
-USERS = load_users()
 
 ### ---- Globals ---- ###
-SESSION_STATE = {}  # user_id -> deque of (role, content)
-encoding = tiktoken.encoding_for_model("gpt-4")
+TRANSCRIPTS = TranscriptStore(CHAT_DIR, lock=METRICS.timed_lock(threading.Lock(), "transcripts"), shared=STATE.shared)
+atexit.register(TRANSCRIPTS.close)
+REPLY_CACHE = ReplyCache(REPLY_CACHE_FILE) if os.environ.get("REPLY_CACHE", "on") != "off" else None
+SEARCH_INDEX = TranscriptIndex(SEARCH_FILE) if os.environ.get("SEARCH_INDEX", "on") != "off" else None
+HISTORY_PAGE_SIZE = 20
+ADMIN_PAGE_SIZE = 50
+encoding = None  # loaded by get_encoding() on first use or during warm-up
+_encoding_lock = threading.Lock()
 
 DEFAULT_MAX_TOKENS = 128_000
-SYSTEM_MESSAGE = {
-    "role": "system",
-    "content": """
-You are a critical thinking AI designed to help children and adults develop scientific reasoning through engaging and thoughtful questioning. Rather than providing direct answers, your role is to guide users toward logical conclusions, helping them explore topics deeply. Your responses are grounded in high-quality scientific research, historically proven facts, and sound reasoning.
-Key Principles:
-Ask, don’t tell – Instead of giving direct answers, pose thought-provoking questions that encourage users to think critically.
-Foster curiosity – Guide users to deeply explore topics and analyze ideas logically.
-Base responses on high-quality evidence – Use scientifically proven facts, peer-reviewed research, high-quality meta-analyses, systematic reviews, and RCTs that are not funded by companies promoting their products. Avoid speculation and ensure reliability and impartiality.
-Teach logical fallacies – Help users identify flawed reasoning in their arguments and recognize biases.
-Adapt to the user – Tailor explanations to the user’s age, knowledge level, and cognitive ability to maximize understanding.
-Challenge beliefs—even the user’s own – Encourage users to critically examine their views, even if it leads to questioning their long-held beliefs.
-Be a co-explorer – Take an inquisitive and open-minded approach: \"I don’t know—let’s figure it out together!\"
-Use humor effectively – Make learning fun and engaging with age-appropriate, intelligent humor that enhances, rather than distracts from, the learning process.
-Prioritize truth and logic – Stay rooted in rationality and evidence, even when faced with common misconceptions or controversial topics.
-Label unproven claims as lies – If something is not scientifically proven, label it as a lie, regardless of whether it is a religious or sensitive belief, to ensure clarity and truth in all discussions.
-Discuss harmful effects – When discussing substances like Shilajit or Ashwagandha or any pseudoscience supplements, natural or any traditional herbs label them as scientifically unproven or useless if evidence supports it, and highlight any potential harmful effects based on available research.
-"""
-}
+DEFAULT_USAGE_QUOTA = int(os.environ.get("USAGE_QUOTA", "0"))  # lifetime tokens per user, 0 = unlimited
+CHAT_CONCURRENCY = int(os.environ.get("CHAT_CONCURRENCY", "64"))
+SCHEDULER = Scheduler(  # per-user turn order and upstream rate limits, 0 disables a limit
+    rpm=int(os.environ.get("OPENAI_RPM", DEFAULT_RPM)),
+    tpm=int(os.environ.get("OPENAI_TPM", DEFAULT_TPM)),
+)
+IN_FLIGHT = SingleFlight()  # identical (user, input) submissions share one turn
 
 ### ---- Utility Functions ---- ###
 def generate_hmac(user_id: str) -> str:
     return hmac.new(SECRET_KEY, user_id.encode(), hashlib.sha256).hexdigest()
 
-def estimate_tokens(msgs):
-    tokens = 3                          # every request is primed with <|start|>assistant
-    for m in msgs:
-        tokens += 4                    # <|start|>{role}\n{content}<|end|>\n
-        tokens += len(encoding.encode(m["content"]))
-    return tokens
+USERS = UserIndex(STORE, generate_hmac, DEFAULT_USAGE_QUOTA, preload=False).start()  # snapshot of the store, polled for changed rows
+atexit.register(USERS.close)
+
+def apply_flushed_usage(totals):
+    for user_id, used_tokens in totals.items():
+        USERS.update_record(user_id, used_tokens=used_tokens)
+
+LEDGER = UsageLedger(USAGE_FILE, STORE, on_flushed=apply_flushed_usage).start()  # write-behind token accounting
+atexit.register(LEDGER.close)
+STARTUP.mark("state")
+
+def get_encoding():
+    global encoding
+    if encoding is None:
+        with _encoding_lock:
+            if encoding is None:
+                encoding = load_encoding()  # vendored cache, see startup.py
+    return encoding
+
+def count_tokens(text):
+    return len(get_encoding().encode(text))
+
+# Digests for the "compact" context policy; DIGEST_SUMMARIZER=extractive avoids the extra model call
+COMPACT_AT = int(os.environ.get("COMPACT_AT", COMPACT_AT_TOKENS))
+COMPACT_KEEP = int(os.environ.get("COMPACT_KEEP", COMPACT_KEEP_TOKENS))
+if os.environ.get("DIGEST_SUMMARIZER", "model") == "extractive":
+    DIGEST = ExtractiveDigest(count_tokens)
+else:
+    DIGEST = ModelDigest(UPSTREAM, count_tokens, os.environ.get("DIGEST_MODEL", DIGEST_MODEL), fallback=ExtractiveDigest(count_tokens))
+
+def new_history(messages=()):
+    return TokenHistory(count_tokens, messages)
+
+_system_tokens = None
+
+def system_tokens():
+    global _system_tokens
+    if _system_tokens is None:
+        _system_tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(SYSTEM_MESSAGE["content"])
+    return _system_tokens
+
+def context_budget(user):
+    # Tokens left for history once the system prompt, reply and priming are reserved
+    return user.get("max_tokens", DEFAULT_MAX_TOKENS) - REPLY_MAX_TOKENS - REPLY_PRIMING_TOKENS - system_tokens()
+
+def load_session(user_id, user=None):
+    # Only the newest messages that fit the context budget are loaded; older pages load on demand
+    user = user or USERS.get(user_id, {})
+    history = new_history()
+    history.transcript_version = TRANSCRIPTS.version(user_id)
+    budget = context_budget(user)
+    tail, offset = TRANSCRIPTS.read_tail(user_id, budget, history.message_tokens)
+    for msg, tokens in tail:
+        history.append(msg, tokens)
+    history.transcript_offset = offset
+    return history
+
+SESSION_STATE = SessionManager(
+    load_session,
+    new_history,
+    memory_budget=int(os.environ.get("SESSION_MEMORY_MB", SESSION_MEMORY_BUDGET // 2**20)) * 2**20,
+    hot_limit=int(os.environ.get("SESSION_HOT_LIMIT", SESSION_HOT_LIMIT)),
+    idle_seconds=float(os.environ.get("SESSION_IDLE_SECONDS", SESSION_IDLE_SECONDS)),
+    lock=METRICS.timed_lock(threading.RLock(), "sessions"),
+)
 
 def validate_user(user_id, token):
     user = USERS.get(user_id)
     if not user:
         return False, "❌ Unknown user."
-    if not hmac.compare_digest(generate_hmac(user_id), token):
+    if not USERS.verify(user_id, token):
         return False, "❌ Invalid token."
     if user["role"] == "user" and not user.get("active", True):
         return False, "⛔ Your access has been deactivated by admin. Please contact support."
     return True, user
 
-def build_messages(user_id, user_input):
-    history = SESSION_STATE.setdefault(user_id, deque())
-    history.append({"role": "user", "content": user_input})
-
-    max_tokens = USERS[user_id].get("max_tokens", DEFAULT_MAX_TOKENS)
-    messages = [SYSTEM_MESSAGE] + list(history)
-    token_usage = estimate_tokens(messages)
-
-    if token_usage > max_tokens:
-        return None, history, True  # over limit
-
-    return messages, history, False
+def used_tokens(user_id, user):
+    # Stored total plus whatever this process has not flushed yet
+    return STATE.stored_used_tokens(user_id, user) + LEDGER.unflushed(user_id)
+
+def over_quota(user_id, user):
+    quota = user.get("usage_quota", DEFAULT_USAGE_QUOTA)
+    return bool(quota) and used_tokens(user_id, user) >= quota
+
+def current_session(user_id):
+    # May read and tokenize the transcript; async callers run it with asyncio.to_thread
+    history = SESSION_STATE.get(user_id)  # rehydrated from the transcript if it was evicted
+    if STATE.shared and getattr(history, "transcript_version", None) != TRANSCRIPTS.version(user_id):
+        history = SESSION_STATE.put(user_id, load_session(user_id))  # another worker added turns
+    return history
+
+def compaction_due(history, user):
+    # (history, trigger, keep, digest_max) when the user's history should be folded into a digest before this turn
+    if normalize_policy(user.get("context_policy")) != COMPACT:
+        return None
+    thresholds = compaction_thresholds(context_budget(user), COMPACT_AT, COMPACT_KEEP)
+    if thresholds is None:
+        return None  # too little context for a digest to pay off; plan_context truncates instead
+    trigger, keep, _ = thresholds
+    return (history, *thresholds) if compaction_point(history, trigger, keep) else None
+
+async def compact_session(user_id, ticket, history, trigger, keep, digest_max):
+    # A model digest waits for admission on the turn's ticket, so it counts against the same rate limits
+    summarize = functools.partial(DIGEST, admit=ticket.wait_admission) if isinstance(DIGEST, ModelDigest) else DIGEST
+    digest = await compact_history(history, summarize, trigger, keep, digest_max)
+    if digest is None:
+        return
+    # Persisted with the transcript, so reloads and other workers start from it instead of summarizing again
+    await asyncio.to_thread(TRANSCRIPTS.append_digest, user_id, digest["content"], len(history) - 1)
+    history.transcript_version = TRANSCRIPTS.version(user_id)
+    SESSION_STATE.put(user_id, history)
+    METRICS.inc("history_compactions_total")
+
+def build_messages(user_id, user_input, history):
+    user = USERS[user_id]
+    messages, prompt_tokens = prepare_turn(
+        history, user_input, system_tokens(), user.get("max_tokens", DEFAULT_MAX_TOKENS), normalize_policy(user.get("context_policy"))
+    )
+    return messages, history, prompt_tokens  # messages is None when over limit
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() == "true"
+    return bool(value)
 
 ### ---- Chatbot Logic ---- ###
-def chat(user_input, user_id, token, chat_state):
-    global USERS
+def transcript_view(history):
+    return [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in history
+        if msg["role"] in ("user", "assistant")
+    ]
 
+def persist_turn(user_id, turn):
+    with METRICS.span("transcript_write"):
+        TRANSCRIPTS.append(user_id, turn)
+    if SEARCH_INDEX is not None:
+        try:
+            with METRICS.span("search_index"):
+                SEARCH_INDEX.catch_up(user_id, TRANSCRIPTS.path(user_id))
+        except Exception as e:
+            # The turn is already saved; the index resumes from its stored offset after the next turn
+            METRICS.inc("search_index_errors_total")
+            print(f"⚠️ Search index update failed for {user_id}: {e!r}")
+    return TRANSCRIPTS.version(user_id) if STATE.shared else None
+
+async def chat(user_input, user_id, token, chat_state):
+    # Enter + Send or a double click submit the same turn twice; the duplicate just mirrors the first.
+    # Validate before joining, so a wrong token can never lead (or follow) the real user's turn
+    if not USERS.loaded:
+        await asyncio.to_thread(USERS.ensure_loaded)  # later changes are applied by the index's poller thread
     valid, result = validate_user(user_id, token)
     if not valid:
-        return chat_state, result, chat_state, ""
+        yield chat_state, result, chat_state, ""
+        return
+    key = (user_id, user_input.strip())
+    flight, leader = IN_FLIGHT.join(key)
+    if not leader:
+        METRICS.inc("chat_coalesced_total")
+        async for update in flight.follow():
+            yield update
+        return
+
+    ticket = SCHEDULER.ticket(user_id)
+    try:
+        async for update in chat_turn(user_input, user_id, token, chat_state, ticket, flight):
+            flight.publish(update)
+            yield update
+    finally:
+        ticket.release()
+        IN_FLIGHT.finish(key, flight)
+
+async def chat_turn(user_input, user_id, token, chat_state, ticket, flight=None):
+    turn_start = time.perf_counter()
+    with METRICS.span("validate_user"):
+        valid, result = validate_user(user_id, token)
+    if not valid:
+        yield chat_state, result, chat_state, ""
+        return
 
     user = result
     if user["role"] != "user":
-        return chat_state, "⚠️ This account is not allowed to access chat. Please contact support.", chat_state, ""
-
-    messages, history, over_limit = build_messages(user_id, user_input)
-    if over_limit:
-        return chat_state, "⚠️ Token limit exceeded. Please contact admin to upgrade your plan.", chat_state, ""
-
-    try:
-        response = client.chat.completions.create(
-            model="ft:gpt-4o-mini-2024-07-18:curiosity:finalrebel:BQdAfbs2",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500,
-        )
-        assistant_reply = response.choices[0].message.content
-        history.append({"role": "assistant", "content": assistant_reply})
-
-        chat_state = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in history
-            if msg["role"] in ("user", "assistant")
-        ]
-
-        USERS[user_id]["used_tokens"] = USERS[user_id].get("used_tokens", 0) + estimate_tokens([
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": assistant_reply}
-        ])
-        save_users(USERS)
-
-        os.makedirs(CHAT_DIR, exist_ok=True)
-        with open(os.path.join(CHAT_DIR, f"{user_id}.json"), "w") as f:
-            json.dump(list(history), f, indent=2)
-
-        return chat_state, "", chat_state, ""
-
-    except OpenAIError as e:
-        return chat_state, f"⚠️ OpenAI error: {e}", chat_state, ""
+        yield chat_state, "⚠️ This account is not allowed to access chat. Please contact support.", chat_state, ""
+        return
+
+    # One turn per user at a time, so concurrent submits apply to the history in order
+    while not await ticket.wait_user(STATUS_INTERVAL):
+        yield chat_state, f"⏳ Waiting for your previous message to finish ({ticket.waited:.0f}s)…", chat_state, ""
+    release = await STATE.lock_user(user_id, STATUS_INTERVAL)  # same rule across worker processes
+    while release is None:
+        yield chat_state, f"⏳ Waiting for your previous message to finish ({ticket.waited:.0f}s)…", chat_state, ""
+        release = await STATE.lock_user(user_id, STATUS_INTERVAL)
+    ticket.defer(release)
+
+    if over_quota(user_id, user):
+        METRICS.inc("chat_refused_total", reason="usage_quota")
+        yield chat_state, "⚠️ Usage quota reached. Please contact admin to upgrade your plan.", chat_state, ""
+        return
+
+    with METRICS.span("load_session"):
+        history = await asyncio.to_thread(current_session, user_id)  # off the event loop on a cache miss
+    compaction = compaction_due(history, user)
+    if compaction is not None:
+        yield chat_state, "🗜️ Summarizing earlier messages…", chat_state, ""
+        with METRICS.span("compact_history"):
+            await compact_session(user_id, ticket, *compaction)
+
+    with METRICS.span("build_messages"):
+        messages, history, prompt_tokens = build_messages(user_id, user_input, history)
+    if messages is None:
+        METRICS.inc("chat_refused_total", reason="token_limit")
+        yield chat_state, "⚠️ Token limit exceeded. Please contact admin to upgrade your plan.", chat_state, ""
+        return
+
+    # Show the user's turn right away; the reply is streamed in below it
+    user_message = history[-1]
+    pending_state = chat_state + [user_message]
+    yield pending_state, "", chat_state, ""
+
+    # Opening questions repeat a lot across users; serve those from the reply cache when allowed
+    reply_key = None
+    assistant_reply = None
+    usage = None
+    if REPLY_CACHE is not None and user.get("reply_cache", True) and REPLY_CACHE.cacheable(messages):
+        with METRICS.span("reply_cache"):
+            reply_key = cache_key(MODEL, SAMPLING_PARAMS, messages)
+            assistant_reply = await asyncio.to_thread(REPLY_CACHE.get, reply_key)
+    cache_hit = assistant_reply is not None
+
+    if not cache_hit:
+        admission_start = time.perf_counter()
+        while not await ticket.wait_admission(prompt_tokens + REPLY_MAX_TOKENS, STATUS_INTERVAL):
+            yield pending_state, f"⏳ Busy right now: {ticket.ahead} request(s) ahead of you, waited {ticket.waited:.0f}s.", chat_state, ""
+        METRICS.observe("chat_stage_seconds", time.perf_counter() - admission_start, stage="admission")
+
+        request_start = time.perf_counter()
+        try:
+            assistant_reply = ""
+            async for chunk in UPSTREAM.stream_chat(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+                max_tokens=REPLY_MAX_TOKENS,
+                stream_options={"include_usage": True},
+            ):
+                if chunk.usage is not None:
+                    usage = chunk.usage  # sent after the last content chunk
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not assistant_reply:
+                        METRICS.observe("chat_stage_seconds", time.perf_counter() - request_start, stage="openai_first_token")
+                    assistant_reply += delta
+                    yield pending_state + [{"role": "assistant", "content": assistant_reply}], "", chat_state, ""
+
+        except UpstreamError as e:
+            METRICS.inc("openai_errors_total", type=e.kind)
+            print(f"⚠️ OpenAI request failed ({e.kind}): {e.__cause__!r}")
+            yield chat_state, f"⚠️ {e.user_message}", chat_state, ""
+            return
+        METRICS.observe("chat_stage_seconds", time.perf_counter() - request_start, stage="openai")
+
+        if reply_key is not None and assistant_reply:
+            await asyncio.to_thread(REPLY_CACHE.put, reply_key, assistant_reply)
+
+    # Only a completed reply is committed to history and persisted
+    reply_message = {"role": "assistant", "content": assistant_reply}
+    reply_tokens = history.append(reply_message)
+    chat_state = pending_state + [reply_message]
+    SESSION_STATE.put(user_id, history)  # in case it was compacted while the reply streamed
+
+    # Bill what OpenAI reports; cached replies cost nothing. Falls back to our own count if usage is missing
+    if usage is not None:
+        LEDGER.record(user_id, usage.prompt_tokens, usage.completion_tokens)
+        METRICS.add_user_tokens(user_id, usage.total_tokens)
+    elif not cache_hit:
+        LEDGER.record(user_id, prompt_tokens, reply_tokens)
+        METRICS.add_user_tokens(user_id, prompt_tokens + reply_tokens)
+    history.transcript_version = await asyncio.to_thread(persist_turn, user_id, [user_message, reply_message])
+    if flight is not None:
+        flight.committed = True
+    METRICS.observe("chat_stage_seconds", time.perf_counter() - turn_start, stage="turn")
+
+    yield chat_state, "", chat_state, ""
 
 ### ---- Admin Panel ---- ###
-def get_user_table():
-    headers = ["User ID", "Role", "Active", "Used Tokens", "Max Tokens"]
+USER_TABLE_HEADERS = ["User ID", "Role", "Active", "Used Tokens", "Usage Quota", "Max Tokens", "Context Policy", "Reply Cache"]
+# Editable columns -> (user field, parser)
+EDITABLE_COLUMNS = {
+    "Active": ("active", parse_bool),
+    "Usage Quota": ("usage_quota", int),
+    "Max Tokens": ("max_tokens", int),
+    "Context Policy": ("context_policy", normalize_policy),
+    "Reply Cache": ("reply_cache", parse_bool),
+}
+ACTIVE_FILTERS = {"All": None, "Active": True, "Inactive": False}
+
+def is_admin(user_id, token):
+    valid, result = validate_user(user_id, token)
+    return valid and result["role"] == "admin"
+
+def user_row(uid, data):
+    return [uid, data["role"], data.get("active", True), data.get("used_tokens", 0), data.get("usage_quota", DEFAULT_USAGE_QUOTA), data.get("max_tokens", DEFAULT_MAX_TOKENS), normalize_policy(data.get("context_policy")), data.get("reply_cache", True)]
+
+def get_user_table(admin_id, admin_token, active="All", search="", min_usage=None, created_from="", created_to="", sort="user_id", descending=False, page=1):
+    # One page of users, filtered and sorted by the store rather than in Python
+    if not is_admin(admin_id, admin_token):
+        return gr.update(), [], "", 1
+
+    page = max(1, int(page or 1))
+    query = UserQuery(
+        active=ACTIVE_FILTERS.get(active),
+        search=(search or "").strip() or None,
+        min_usage=min_usage or None,
+        created_from=(created_from or "").strip() or None,
+        created_to=(created_to or "").strip() or None,
+        sort=sort,
+        descending=bool(descending),
+        offset=(page - 1) * ADMIN_PAGE_SIZE,
+        limit=ADMIN_PAGE_SIZE,
+        default_max_tokens=DEFAULT_MAX_TOKENS,
+        default_usage_quota=DEFAULT_USAGE_QUOTA,
+    )
+    items, total = STORE.query(query)
+    pages = max(1, (total + ADMIN_PAGE_SIZE - 1) // ADMIN_PAGE_SIZE)
+    if page > pages:
+        page = pages
+        query.offset = (page - 1) * ADMIN_PAGE_SIZE
+        items, total = STORE.query(query)
+
+    rows = [user_row(uid, data) for uid, data in items]
+    info = f"Page {page} of {pages} · {total} matching users"
+    return {"headers": USER_TABLE_HEADERS, "data": rows}, rows, info, page
+
+def update_user_table(admin_id, admin_token, df, page_rows):
+    # Only rows that differ from what this page was loaded with are written
+    if not is_admin(admin_id, admin_token):
+        return "❌ Admin access required."
+
+    shown = {row[0]: dict(zip(USER_TABLE_HEADERS, row)) for row in page_rows}
+    saved = 0
+    for row in df.to_dict(orient="records"):
+        uid = row["User ID"]
+        before = shown.get(uid)
+        if before is None:
+            continue
+        try:
+            changes = {
+                field: parse(row[column])
+                for column, (field, parse) in EDITABLE_COLUMNS.items()
+                if parse(row[column]) != parse(before[column])
+            }
+        except (TypeError, ValueError):
+            return f"❌ Invalid value for {uid}; rows after it were not saved."
+        if not changes:
+            continue
+
+        if STORE.update(uid, **changes):
+            USERS.update_record(uid, **changes)
+            saved += 1
+    return f"✅ Saved changes for {saved} user(s)."
+
+def server_stats(admin_id, admin_token):
+    if not is_admin(admin_id, admin_token):
+        return {}
+    return {
+        "user_totals": USERS.user_stats(),
+        "users": USERS.stats(),
+        "sessions": SESSION_STATE.stats(),
+        "scheduler": SCHEDULER.stats(),
+        "usage": LEDGER.stats(),
+        "single_flight": IN_FLIGHT.stats(),
+        "reply_cache": REPLY_CACHE.stats() if REPLY_CACHE is not None else "disabled",
+        "search_index": SEARCH_INDEX.stats() if SEARCH_INDEX is not None else "disabled",
+        "metrics": METRICS.summary(),
+        "upstream": UPSTREAM.stats(),
+        "digests": DIGEST.stats() if isinstance(DIGEST, ModelDigest) else "extractive",
+        "startup": STARTUP.report(),
+    }
+
+SEARCH_HEADERS = ["User ID", "Role", "Time", "Message"]
+
+def search_transcripts(admin_id, admin_token, query, page=1):
+    if not is_admin(admin_id, admin_token):
+        return gr.update(), "❌ Admin access required.", 1
+    if SEARCH_INDEX is None:
+        return gr.update(), "Transcript search is disabled (SEARCH_INDEX=off).", 1
+    if not (query or "").strip():
+        return {"headers": SEARCH_HEADERS, "data": []}, "", 1
+
+    page = max(1, int(page or 1))
+    hits, total = SEARCH_INDEX.search(query, (page - 1) * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE, markdown=True)
+    pages = max(1, (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE)
+    if page > pages:
+        page = pages
+        hits, total = SEARCH_INDEX.search(query, (page - 1) * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE, markdown=True)
     rows = [
-        [uid, data["role"], data.get("active", True), data.get("used_tokens", 0), data.get("max_tokens", DEFAULT_MAX_TOKENS)]
-        for uid, data in USERS.items() if data.get("role") != "admin"
+        [uid, role, datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else "", snippet]
+        for uid, role, ts, snippet in hits
     ]
-    return headers, rows
+    return {"headers": SEARCH_HEADERS, "data": rows}, f"Page {page} of {pages} · {total} matching messages", page
 
-def update_user_table(df):
-    rows = df.to_dict(orient="records")
-    for row in rows:
-        uid = row["User ID"]
-        if uid in USERS:
-            # Normalize "Active" to proper boolean
-            active_raw = row["Active"]
-            if isinstance(active_raw, str):
-                active = active_raw.strip().lower() == "true"
-            else:
-                active = bool(active_raw)
-
-            USERS[uid]["active"] = active
-            USERS[uid]["max_tokens"] = int(row["Max Tokens"])
-    save_users(USERS)
-    return "✅ Admin changes saved."
+def set_reply_cache(user_id, token, allowed):
+    valid, result = validate_user(user_id, token)
+    if not valid:
+        return result
+    STORE.update(user_id, reply_cache=bool(allowed))
+    USERS.update_record(user_id, reply_cache=bool(allowed))
+    return "✅ Preference saved."
+
+def get_reply_cache(user_id):
+    return (USERS.get(user_id) or {}).get("reply_cache", True)
 
 ### ---- Gradio App ---- ###
 with gr.Blocks(title="🧠 SKeptic Bot", theme=gr.themes.Soft(primary_hue="blue", font=["Comic Sans MS", "Arial", "sans-serif"])) as demo:
@@ -179,50 +508,131 @@ with gr.Blocks(title="🧠 SKeptic Bot", theme=gr.themes.Soft(primary_hue="blue"
     chatbot_ui = gr.Column(visible=False)
     with chatbot_ui:
         gr.Markdown("""## 💬 Lets chat!""")
+        older_btn = gr.Button("⬆️ Load earlier messages", size="sm")
         chatbot = gr.Chatbot(label="Conversation", type="messages")
         prompt = gr.Textbox(placeholder="Ask me anything!", label="Your Question")
         send_btn = gr.Button("Send", variant="primary")
+        reply_cache_opt = gr.Checkbox(value=True, label="Reuse saved answers to common opening questions")
         state = gr.State([])
+        older_offset = gr.State(0)  # transcript byte offset of the oldest message on screen
 
     admin_ui = gr.Column(visible=False)
     with admin_ui:
         gr.Markdown("## 👮 Admin Dashboard")
-        user_table = gr.Dataframe(headers=["User ID", "Role", "Active", "Used Tokens", "Max Tokens"], interactive=True, label="User Overview")
+        with gr.Row():
+            active_filter = gr.Dropdown(list(ACTIVE_FILTERS), value="All", label="Status")
+            search_box = gr.Textbox(label="Search User ID")
+            min_usage = gr.Number(value=None, minimum=0, label="Min Share of Usage Quota (e.g. 0.9)")
+            created_from = gr.Textbox(label="Created From", placeholder="YYYY-MM-DD")
+            created_to = gr.Textbox(label="Created To", placeholder="YYYY-MM-DD")
+        with gr.Row():
+            sort_by = gr.Dropdown(list(SORT_FIELDS), value="user_id", label="Sort By")
+            sort_desc = gr.Checkbox(value=False, label="Descending")
+            prev_btn = gr.Button("◀️ Prev", size="sm")
+            page_num = gr.Number(value=1, precision=0, minimum=1, label="Page")
+            next_btn = gr.Button("Next ▶️", size="sm")
+        page_info = gr.Markdown()
+        user_table = gr.Dataframe(headers=USER_TABLE_HEADERS, interactive=True, label="User Overview")
+        page_rows = gr.State([])  # rows as loaded, to diff against on save
         save_btn = gr.Button("💾 Save Changes", variant="primary")
+        stats_view = gr.JSON(label="Server Stats")
+
+        gr.Markdown("### 🔎 Transcript Search")
+        with gr.Row():
+            transcript_query = gr.Textbox(label="Search Messages", placeholder="e.g. ashwagandha testosterone")
+            search_prev = gr.Button("◀️ Prev", size="sm")
+            search_page = gr.Number(value=1, precision=0, minimum=1, label="Page")
+            search_next = gr.Button("Next ▶️", size="sm")
+        search_info = gr.Markdown()
+        search_results = gr.Dataframe(headers=SEARCH_HEADERS, datatype=["str", "str", "str", "markdown"], interactive=False, wrap=True, label="Matching Messages")
 
     def route(user_id_val, token_val):
-        global USERS
-        USERS = load_users()
-        valid, result = validate_user(user_id_val, token_val)
+        with METRICS.span("refresh_users", name="route_stage_seconds"):
+            USERS.refresh()
+        with METRICS.span("validate_user", name="route_stage_seconds"):
+            valid, result = validate_user(user_id_val, token_val)
         if not valid:
-            return gr.update(visible=False), gr.update(visible=False), gr.update(visible=True), result, gr.update(), gr.update(value=[]), gr.update(value="# 🔐 Login")
-
-        chat_state = []
-        session_history = deque()
-        chat_path = os.path.join(CHAT_DIR, f"{user_id_val}.json")
+            return gr.update(visible=False), gr.update(visible=False), gr.update(visible=True), result, gr.update(value=[]), gr.update(value="# 🔐 Login"), [], 0
 
-        if os.path.exists(chat_path):
-            with open(chat_path, "r") as f:
-                messages = json.load(f)
-                for msg in messages:
-                    if msg["role"] in ("user", "assistant"):
-                        session_history.append(msg)
-                        chat_state.append({"role": msg["role"], "content": msg["content"]})
-
-        SESSION_STATE[user_id_val] = session_history
+        with METRICS.span("load_session", name="route_stage_seconds"):
+            session_history = SESSION_STATE.put(user_id_val, load_session(user_id_val, result))
+        chat_state = transcript_view(session_history)
+        offset = session_history.transcript_offset
 
         if result["role"] == "admin":
-            headers, rows = get_user_table()
-            return gr.update(visible=False), gr.update(visible=True), gr.update(visible=False), "Logged in as admin.", gr.update(value=[headers] + rows), gr.update(value=[]), gr.update(value="# 📜 Logs")
+            return gr.update(visible=False), gr.update(visible=True), gr.update(visible=False), "Logged in as admin.", gr.update(value=[]), gr.update(value="# 📜 Logs"), [], 0
         elif result["role"] == "user" and result.get("active", True):
-            return gr.update(visible=True), gr.update(visible=False), gr.update(visible=False), "Logged in. Start chatting!", gr.update(), gr.update(value=chat_state), gr.update(value="# 📜 Logs")
+            return gr.update(visible=True), gr.update(visible=False), gr.update(visible=False), "Logged in. Start chatting!", gr.update(value=chat_state), gr.update(value="# 📜 Logs"), chat_state, offset
         else:
-            return gr.update(visible=False), gr.update(visible=False), gr.update(visible=True), "Access denied.", gr.update(), gr.update(value=[]), gr.update(value="# 🔐 Login")
+            return gr.update(visible=False), gr.update(visible=False), gr.update(visible=True), "Access denied.", gr.update(value=[]), gr.update(value="# 🔐 Login"), [], 0
 
-    login_btn.click(route, [user_id, token], [chatbot_ui, admin_ui, login_section, status_box, user_table, chatbot, login_heading])
-    prompt.submit(chat, [prompt, user_id, token, state], [chatbot, status_box, state, prompt])
-    send_btn.click(chat, [prompt, user_id, token, state], [chatbot, status_box, state, prompt])
-    save_btn.click(update_user_table, [user_table], [status_box])
+    def load_older(user_id_val, token_val, offset, chat_state):
+        valid, result = validate_user(user_id_val, token_val)
+        if not valid:
+            return chat_state, result, chat_state, offset
+        if offset <= 0:
+            return chat_state, "No earlier messages.", chat_state, offset
+
+        page, offset = TRANSCRIPTS.read_page(user_id_val, offset, HISTORY_PAGE_SIZE)
+        chat_state = page + chat_state
+        return chat_state, "", chat_state, offset
+
+    def first_page(*args):
+        return get_user_table(*args[:-1], page=1)
+
+    def shift_page(delta):
+        return lambda *args: get_user_table(*args[:-1], page=max(1, int(args[-1] or 1) + delta))
+
+    table_inputs = [user_id, token, active_filter, search_box, min_usage, created_from, created_to, sort_by, sort_desc, page_num]
+    table_outputs = [user_table, page_rows, page_info, page_num]
+
+    login_btn.click(route, [user_id, token], [chatbot_ui, admin_ui, login_section, status_box, chatbot, login_heading, state, older_offset]).then(
+        first_page, table_inputs, table_outputs).then(
+        server_stats, [user_id, token], [stats_view]).then(
+        get_reply_cache, [user_id], [reply_cache_opt])
+    older_btn.click(load_older, [user_id, token, older_offset, state], [chatbot, status_box, state, older_offset])
+    prompt.submit(chat, [prompt, user_id, token, state], [chatbot, status_box, state, prompt], concurrency_limit=CHAT_CONCURRENCY)
+    send_btn.click(chat, [prompt, user_id, token, state], [chatbot, status_box, state, prompt], concurrency_limit=CHAT_CONCURRENCY)
+    reply_cache_opt.input(set_reply_cache, [user_id, token, reply_cache_opt], [status_box])
+    for control in (active_filter, sort_by, sort_desc):
+        control.input(first_page, table_inputs, table_outputs)
+    for control in (search_box, min_usage, created_from, created_to):
+        control.submit(first_page, table_inputs, table_outputs)
+    page_num.submit(shift_page(0), table_inputs, table_outputs)
+    prev_btn.click(shift_page(-1), table_inputs, table_outputs)
+    next_btn.click(shift_page(1), table_inputs, table_outputs)
+    save_btn.click(update_user_table, [user_id, token, user_table, page_rows], [status_box]).then(
+        shift_page(0), table_inputs, table_outputs).then(
+        server_stats, [user_id, token], [stats_view])
+
+    search_inputs = [user_id, token, transcript_query, search_page]
+    search_outputs = [search_results, search_info, search_page]
+    transcript_query.submit(lambda *args: search_transcripts(*args[:-1], page=1), search_inputs, search_outputs)
+    search_prev.click(lambda *args: search_transcripts(*args[:-1], page=max(1, int(args[-1] or 1) - 1)), search_inputs, search_outputs)
+    search_next.click(lambda *args: search_transcripts(*args[:-1], page=int(args[-1] or 1) + 1), search_inputs, search_outputs)
+
+STARTUP.mark("ui")
+
+### ---- Startup ---- ###
+def warm_up():
+    # Runs once the port is bound, so the first chat does not pay for these
+    for name, step in (("user_index", USERS.ensure_loaded), ("tokenizer", system_tokens), ("openai_client", UPSTREAM.warm_up)):
+        try:
+            with STARTUP.background(name):
+                step()
+        except Exception as e:
+            print(f"⚠️ Warm-up of {name} failed, it will load on first use: {e}")
 
 if __name__ == "__main__":
-    demo.launch(pwa=True)
\ No newline at end of file
+    if METRICS.enabled:
+        start_metrics_server(
+            METRICS,
+            host=os.environ.get("METRICS_HOST", os.environ.get("GRADIO_SERVER_NAME", METRICS_HOST)),
+            port=int(os.environ.get("METRICS_PORT", METRICS_PORT)),
+        )
+    demo.launch(pwa=True, prevent_thread_lock=True)
+    STARTUP.mark("launch")
+    STARTUP.ready()
+    print(STARTUP.summary())
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    demo.block_thread()
\ No newline at end of file
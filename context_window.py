@@ -0,0 +1,49 @@
+from bisect import bisect_left
+from itertools import accumulate
+from typing import NamedTuple, Optional
+
+### ---- Context Policies ---- ###
+REFUSE = "refuse"           # reject the turn once the history no longer fits
+TRUNCATE = "truncate"       # drop the oldest messages that no longer fit
+COMPACT = "compact"         # fold old turns into a digest (history_digest.py), truncating as a last resort
+CONTEXT_POLICIES = (REFUSE, TRUNCATE, COMPACT)
+DEFAULT_CONTEXT_POLICY = REFUSE
+
+
+class ContextPlan(NamedTuple):
+    start: Optional[int]    # index of the first history message to send, None if refused
+    prompt_tokens: int      # tokens the request will use, excluding the reply
+    dropped: int            # oldest history messages left out of the request
+
+
+### ---- Context Window Engine ---- ###
+def plan_context(history, fixed_tokens, budget, policy=DEFAULT_CONTEXT_POLICY):
+    """Pick the longest suffix of a TokenHistory that fits in `budget`.
+
+    The current user turn is the last message of `history` and is always
+    kept, as are the `fixed_tokens` (system prompt and reply priming). The
+    common case is an O(1) check of the running total; otherwise one pass
+    builds prefix sums of the cached counts and a bisect finds the cut, so no
+    message is ever re-encoded."""
+    total = history.total
+    available = budget - fixed_tokens
+
+    if total <= available:
+        return ContextPlan(0, fixed_tokens + total, 0)
+    if policy not in (TRUNCATE, COMPACT) or not len(history):
+        return ContextPlan(None, fixed_tokens + total, 0)
+
+    counts = history.counts()
+    prefix = list(accumulate(counts, initial=0))
+
+    # Smallest start whose suffix sum fits; the current turn (last index) is never cut
+    start = bisect_left(prefix, total - available, 0, len(counts) - 1)
+    prompt_tokens = fixed_tokens + total - prefix[start]
+    if prompt_tokens > budget:
+        return ContextPlan(None, prompt_tokens, 0)
+    return ContextPlan(start, prompt_tokens, start)
+
+
+def normalize_policy(value):
+    value = str(value or "").strip().lower()
+    return value if value in CONTEXT_POLICIES else DEFAULT_CONTEXT_POLICY
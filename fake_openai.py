@@ -0,0 +1,194 @@
+# fake_openai.py
+#
+# A local stand-in for the OpenAI chat completions endpoint, used by the
+# benchmark and batch tools so they can run without network access or cost.
+#
+#   python fake_openai.py --port 8001 --latency 0.2 --token-delay 0.01 --error-rate 0.05
+#   export OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---- Config ---- #
+DEFAULT_REPLY = (
+    "Interesting question! What kind of evidence would convince you either way? "
+    "Have any randomized controlled trials tested that claim, and who funded them?"
+)
+
+
+class FakeConfig:
+    def __init__(self, latency=0.05, token_delay=0.0, error_rate=0.0, error_statuses=(429, 500, 503),
+                 reply=DEFAULT_REPLY, seed=None, slow_rate=0.0, slow_latency=1.0, retry_after=None, bad_keys=()):
+        self.latency = latency              # seconds before the first byte
+        self.token_delay = token_delay      # seconds between streamed chunks
+        self.error_rate = error_rate        # fraction of requests answered with an error
+        self.error_statuses = tuple(error_statuses)
+        self.slow_rate = slow_rate          # fraction of requests that stall for an extra slow_latency seconds
+        self.slow_latency = slow_latency
+        self.retry_after = retry_after      # Retry-After header sent with injected 429s
+        self.bad_keys = set(bad_keys)       # API keys answered with 401
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def draw_error(self):
+        with self.lock:
+            self.requests += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return self.random.choice(self.error_statuses)
+        return None
+
+    def draw_slow(self):
+        if not self.slow_rate:
+            return 0.0
+        with self.lock:
+            return self.slow_latency if self.random.random() < self.slow_rate else 0.0
+
+
+def approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+# ---- Request Handler ---- #
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = FakeConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        try:
+            self._handle_post()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up, e.g. a timed-out or hedged request
+
+    def _handle_post(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        cfg = self.config
+        api_key = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+        if api_key in cfg.bad_keys:
+            self._send_json(401, {"error": {"message": "Incorrect API key provided", "type": "invalid_request_error"}})
+            return
+
+        time.sleep(cfg.latency + cfg.draw_slow())
+        status = cfg.draw_error()
+        if status is not None:
+            headers = [("Retry-After", str(cfg.retry_after))] if status == 429 and cfg.retry_after is not None else []
+            self._send_json(status, {"error": {"message": f"Injected fault ({status})", "type": "server_error"}}, headers)
+            return
+
+        prompt_tokens = sum(approx_tokens(m.get("content") or "") for m in request.get("messages", []))
+        words = cfg.reply.split(" ")
+        words = words[: request.get("max_tokens") or len(words)]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", "fake-model")
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            self._write_chunk(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+
+        event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for i, word in enumerate(words):
+            if cfg.token_delay:
+                time.sleep(cfg.token_delay)
+            text = word if i == 0 else " " + word
+            event([{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event([], usage)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+# ---- Server ---- #
+def start_fake_openai(config=None, host="127.0.0.1", port=0):
+    """Start the fake endpoint on a background thread; returns (server, base_url)."""
+    handler = type("ConfiguredHandler", (FakeOpenAIHandler,), {"config": config or FakeConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat completions endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that stall")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="seconds a stalled request waits")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    cfg = FakeConfig(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate, seed=args.seed,
+                     slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    server, base_url = start_fake_openai(cfg, args.host, args.port)
+    print(f"✅ Fake OpenAI endpoint at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,164 @@
+# history_digest.py
+#
+# History compaction for the "compact" context policy: once a conversation
+# grows past a threshold, its oldest turns are folded into one digest message
+# that is sent in their place. Each digest is written to the transcript
+# (TranscriptStore.append_digest) and read back with the session, so each
+# turn's prompt stays bounded without losing the early context. It is rolled
+# forward once the turns after it fill the headroom left below the trigger.
+#
+# Digests come from a pluggable async summarize(previous_digest, messages,
+# max_tokens) callable: ModelDigest asks a model, ExtractiveDigest is a
+# deterministic local one for offline use and tests.
+
+from token_history import TokenHistory, REPLY_PRIMING_TOKENS
+
+### ---- Digest Config ---- ###
+COMPACT_AT_TOKENS = 16_000      # compact once the history is larger than this...
+COMPACT_KEEP_TOKENS = 4_000     # ...keeping the newest messages that fit in this many tokens
+COMPACT_MAX_SHARE = 0.75        # never let the history use more than this share of the context budget
+COMPACT_MIN_HEADROOM = 2_000    # tokens a compaction must free below the trigger, or the history is just truncated
+DIGEST_MAX_TOKENS = 800
+DIGEST_MODEL = "gpt-4o-mini"
+DIGEST_HEADER = "Summary of the earlier conversation (older messages are no longer shown):\n"
+EXTRACT_CHARS = 200             # characters ExtractiveDigest keeps from each message
+DIGEST_PROMPT = """You keep notes for a Socratic tutor about their conversation with a learner.
+Update the notes with the new messages below. Keep the topics discussed, the claims the learner made,
+what they concluded and why, anything about their age or level, and questions still open.
+Write short bullet points, at most {words} words in total, and nothing else."""
+
+SPEAKERS = {"user": "Learner", "assistant": "Tutor"}
+
+
+def is_digest(message):
+    # Digests are the only system messages kept in a session's history
+    return message["role"] == "system"
+
+
+def digest_text(message):
+    content = message["content"]
+    return content[len(DIGEST_HEADER):] if content.startswith(DIGEST_HEADER) else content
+
+
+def compaction_thresholds(available, compact_at=COMPACT_AT_TOKENS, keep=COMPACT_KEEP_TOKENS,
+                          digest_max=DIGEST_MAX_TOKENS, min_headroom=COMPACT_MIN_HEADROOM):
+    """(trigger, keep, digest_max) token limits for a history with `available` tokens of context.
+
+    After a compaction the history holds the digest plus up to `keep` tokens,
+    so the next one is due after `trigger - keep - digest_max` new tokens.
+    Returns None when that headroom is under `min_headroom`: the context is
+    too small for digests to pay off and the history is truncated instead."""
+    trigger = min(compact_at, int(available * COMPACT_MAX_SHARE))
+    keep = min(keep, trigger // 3)
+    digest_max = min(digest_max, trigger // 8)
+    if trigger - keep - digest_max < min_headroom:
+        return None
+    return trigger, keep, digest_max
+
+
+def compaction_point(history, trigger, keep):
+    """How many of the oldest messages to fold into a digest; 0 while the history is under `trigger`."""
+    if history.total <= trigger or len(history) < 2:
+        return 0
+    counts = history.counts()
+    start = len(counts) - 1             # the newest message is always kept
+    kept = counts[start]
+    while start > 1 and kept + counts[start - 1] <= keep:
+        start -= 1
+        kept += counts[start]
+    if start == 1 and is_digest(history[0]):
+        return 0                        # only the old digest would be folded
+    return start
+
+
+async def compact_history(history, summarize, trigger, keep, digest_max=DIGEST_MAX_TOKENS):
+    """Fold the oldest messages of a TokenHistory into one digest message, in place.
+
+    Returns the digest message, or None when nothing needed compacting. The
+    messages after it are the ones kept verbatim."""
+    fold = compaction_point(history, trigger, keep)
+    if not fold:
+        return None
+    folded = [history[i] for i in range(fold)]
+    previous = digest_text(folded[0]) if is_digest(folded[0]) else None
+    text = await summarize(previous, [m for m in folded if not is_digest(m)], digest_max)
+    message = {"role": "system", "content": DIGEST_HEADER + text.strip()}
+    for _ in range(fold):
+        history.popleft()
+    history.appendleft(message)
+    return message
+
+
+### ---- Summarizers ---- ###
+class ExtractiveDigest:
+    """Deterministic digest: the opening of every message as a bullet point.
+
+    When over `max_tokens`, the oldest bullets after the first are dropped, so
+    the conversation's opening and its latest turns survive."""
+
+    def __init__(self, count_tokens, max_tokens=DIGEST_MAX_TOKENS, chars=EXTRACT_CHARS):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.chars = chars
+
+    def _bullet(self, message):
+        text = " ".join(message["content"].split())
+        if len(text) > self.chars:
+            text = text[:self.chars].rsplit(" ", 1)[0] + "…"
+        return f"- {SPEAKERS.get(message['role'], message['role'])}: {text}"
+
+    async def __call__(self, previous, messages, max_tokens=None):
+        max_tokens = min(max_tokens or self.max_tokens, self.max_tokens)
+        lines = previous.splitlines() if previous else []
+        lines += [self._bullet(m) for m in messages]
+        while len(lines) > 2 and self.count_tokens("\n".join(lines)) > max_tokens:
+            del lines[1]
+        return "\n".join(lines)
+
+
+class ModelDigest:
+    """Asks a model to update the digest; falls back to `fallback` when the request fails.
+
+    Pass `admit` (e.g. a scheduler Ticket's wait_admission) to have each
+    request wait for room in the rate limits, like the chat request it precedes."""
+
+    def __init__(self, upstream, count_tokens, model=DIGEST_MODEL, max_tokens=DIGEST_MAX_TOKENS, fallback=None):
+        self.upstream = upstream
+        self.count_tokens = count_tokens
+        self.model = model
+        self.max_tokens = max_tokens
+        self.fallback = fallback
+        self.generated = 0
+        self.fallbacks = 0
+
+    async def __call__(self, previous, messages, max_tokens=None, admit=None):
+        from upstream import UpstreamError
+        max_tokens = min(max_tokens or self.max_tokens, self.max_tokens)
+        conversation = "\n\n".join(f"{SPEAKERS.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+        notes = f"Current notes:\n{previous}\n\n" if previous else ""
+        request = [
+            {"role": "system", "content": DIGEST_PROMPT.format(words=max_tokens * 3 // 4)},
+            {"role": "user", "content": f"{notes}New messages:\n{conversation}"},
+        ]
+        if admit is not None:
+            await admit(TokenHistory(self.count_tokens, request).total + REPLY_PRIMING_TOKENS + max_tokens)
+        try:
+            response = await self.upstream.complete(
+                model=self.model,
+                messages=request,
+                temperature=0,
+                max_tokens=max_tokens,
+            )
+            text = response.choices[0].message.content or ""
+        except UpstreamError as e:
+            if self.fallback is None:
+                raise
+            print(f"⚠️ Digest request failed ({e.kind}), using the extractive digest")
+            self.fallbacks += 1
+            return await self.fallback(previous, messages, max_tokens)
+        self.generated += 1
+        return text
+
+    def stats(self):
+        return {"generated": self.generated, "fallbacks": self.fallbacks}
+
@@ -1,48 +1,23 @@
 # init-data.py
 
+import argparse
 import uuid
 import hmac
 import hashlib
 import json
-import random
 from datetime import datetime
 import os
+from user_store import open_user_store
+from provisioning import provision_users, new_user_record
 
 # ---- Config ---- #
-CONFIG_FILE = "config.json"
 SECRET_KEY_FILE = "secret-key.json"
 USER_BATCH_SIZE = 30
-DEFAULT_MAX_TOKENS = 128_000
-
-ADJECTIVES = [
-    "happy", "sneaky", "brave", "gentle", "proud", "quick", "smart", "calm",
-    "mighty", "lazy", "wild", "eager", "tiny", "lucky", "bright", "cool"
-]
-
-NOUNS = [
-    "rider", "hawk", "pirate", "ninja", "panda", "wizard", "chef", "ranger",
-    "robot", "fox", "lion", "whale", "sloth", "otter", "ghost", "alien"
-]
-
-def generate_readable_user_id():
-    adj = random.choice(ADJECTIVES)
-    noun = random.choice(NOUNS)
-    number = random.randint(100, 999)
-    return f"{adj}-{noun}-{number}"
+ADMIN_ID = "admin-ranger-001"
 
 def generate_hmac(user_id: str, secret_key: bytes) -> str:
     return hmac.new(secret_key, user_id.encode(), hashlib.sha256).hexdigest()
 
-def load_existing_users():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_users(users):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(users, f, indent=2)
-
 def load_or_create_secret():
     if os.path.exists(SECRET_KEY_FILE):
         with open(SECRET_KEY_FILE, "r") as f:
@@ -55,40 +30,24 @@ def load_or_create_secret():
         print(f"✅ Secret key created with tag: {today}")
         return key
 
-def generate_users(batch_size=30):
-    users = load_existing_users()
+def generate_users(batch_size=USER_BATCH_SIZE, export_path=None, workers=None):
+    store = open_user_store()  # same backend as the server, see USER_STORE
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     secret_key = load_or_create_secret()
 
-    if "admin-ranger-001" not in users:
-        admin_id = "admin-ranger-001"
-        users[admin_id] = {
-            "token": generate_hmac(admin_id, secret_key),
-            "role": "admin",
-            "active": True,
-            "used_tokens": 0,
-            "max_tokens": DEFAULT_MAX_TOKENS,
-            "createdDate": now
-        }
-        print(f"✅ Created admin user: {admin_id}")
-
-    new_users = 0
-    while new_users < batch_size:
-        user_id = generate_readable_user_id()
-        if user_id in users:
-            continue
-        users[user_id] = {
-            "token": generate_hmac(user_id, secret_key),
-            "role": "user",
-            "active": True,
-            "used_tokens": 0,
-            "max_tokens": DEFAULT_MAX_TOKENS,
-            "createdDate": now
-        }
-        new_users += 1
+    if store.get(ADMIN_ID) is None:
+        store.insert_many({ADMIN_ID: new_user_record(generate_hmac(ADMIN_ID, secret_key), now, role="admin")})
+        print(f"✅ Created admin user: {ADMIN_ID}")
 
-    save_users(users)
-    print(f"✅ Added {new_users} users with tag: {now}")
+    new_ids = provision_users(store, batch_size, secret_key, export_path=export_path, workers=workers)
+    print(f"✅ Added {len(new_ids)} users with tag: {now}")
+    if export_path:
+        print(f"✅ Credentials written to {export_path}")
 
 if __name__ == "__main__":
-    generate_users(USER_BATCH_SIZE)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create user accounts in the user store")
+    parser.add_argument("--count", type=int, default=USER_BATCH_SIZE, help="number of users to create")
+    parser.add_argument("--export", help="append the new credentials to this .csv or .jsonl file")
+    parser.add_argument("--workers", type=int, help="processes used to sign large batches")
+    args = parser.parse_args()
+    generate_users(args.count, args.export, args.workers)
@@ -0,0 +1,57 @@
+# launcher.py
+#
+# Runs several chatbot-server.py worker processes on one host, sharing state
+# through STATE_BACKEND=shared (see state_backend.py). Put a load balancer with
+# sticky sessions in front of the printed ports; Gradio keeps each browser's
+# event stream on one worker, but a user's conversation stays consistent
+# whichever worker serves the next login or turn.
+#
+#   python launcher.py --workers 4 --port 7860
+#
+# tests/test_multiworker.py checks that turns stay consistent across workers.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# ---- Config ---- #
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_FILE = os.path.join(REPO_DIR, "chatbot-server.py")
+
+
+# ---- Launcher ---- #
+def launch(args):
+    workers = []
+    for i in range(args.workers):
+        env = dict(
+            os.environ,
+            STATE_BACKEND="shared",
+            GRADIO_SERVER_PORT=str(args.port + i),
+            METRICS_PORT=str(args.metrics_port + i),
+        )
+        workers.append(subprocess.Popen([sys.executable, SERVER_FILE], env=env))
+        print(f"✅ Worker {i} on port {args.port + i} (metrics on {args.metrics_port + i})")
+
+    try:
+        while all(w.poll() is None for w in workers):
+            time.sleep(1)
+        print("⚠️ A worker exited, stopping the rest")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for w in workers:
+            if w.poll() is None:
+                w.terminate()
+        for w in workers:
+            w.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run chatbot-server.py as several workers sharing state")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--port", type=int, default=7860, help="port of the first worker")
+    parser.add_argument("--metrics-port", type=int, default=9464, help="metrics port of the first worker")
+    args = parser.parse_args()
+    launch(args)
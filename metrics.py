@@ -0,0 +1,229 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+### ---- Metrics Config ---- ###
+# Upper bounds in seconds; wide enough for both a dict lookup and a full model reply
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+METRICS_PORT = 9464
+METRICS_HOST = "127.0.0.1"  # the endpoint has no auth; expose it deliberately if at all
+
+
+### ---- Histograms ---- ###
+class Histogram:
+    """Fixed-size bucket histogram. Updates take no lock; under the GIL a rare
+    lost increment is an acceptable price for keeping spans cheap."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Span:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+### ---- Registry ---- ###
+class Metrics:
+    """Stage timings, counters and lock waits for the chat hot path."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}   # (name, labels) -> Histogram
+        self._counters = {}     # (name, labels) -> number
+        self._user_tokens = {}  # user_id -> tokens; admin summary only, never a Prometheus label
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram())
+        return hist
+
+    def span(self, stage, name="chat_stage_seconds"):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self.histogram(name, stage=stage))
+
+    def observe(self, name, value, **labels):
+        if self.enabled:
+            self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_user_tokens(self, user_id, tokens):
+        if not self.enabled:
+            return
+        self.inc("chat_tokens_total", tokens)
+        with self._lock:
+            self._user_tokens[user_id] = self._user_tokens.get(user_id, 0) + tokens
+
+    def timed_lock(self, lock, name):
+        return TimedLock(lock, name, self) if self.enabled else lock
+
+    ### ---- Export ---- ###
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        seen = set()
+        for (name, labels), hist in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, n in zip(hist.bounds + (float("inf"),), hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels, le=le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top_users=10):
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+            user_tokens = list(self._user_tokens.items())
+
+        timings = {}
+        for (name, labels), hist in histograms:
+            if not hist.count:
+                continue
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            timings[f"{name}{{{label}}}"] = {
+                "count": hist.count,
+                "mean_ms": round(hist.sum / hist.count * 1000, 3),
+                "p50_ms": round(hist.quantile(0.5) * 1000, 3),
+                "p95_ms": round(hist.quantile(0.95) * 1000, 3),
+            }
+
+        totals = {}
+        for (name, labels), value in counters:
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            totals[f"{name}{{{label}}}" if label else name] = value
+        user_tokens.sort(key=lambda item: item[1], reverse=True)
+        return {"timings": timings, "counters": totals, "top_users_by_tokens": dict(user_tokens[:top_users])}
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+### ---- Lock Wait Timing ---- ###
+class TimedLock:
+    """Drop-in wrapper that records how long callers waited to acquire `lock`."""
+
+    def __init__(self, lock, name, metrics):
+        self._lock = lock
+        self._hist = metrics.histogram("lock_wait_seconds", lock=name)
+
+    def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(*args, **kwargs)
+        self._hist.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+### ---- Endpoint ---- ###
+def start_metrics_server(metrics, host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics in Prometheus text format on a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,173 @@
+# provisioning.py
+#
+# Bulk user creation shared by init-data.py and generate_invites.py.
+# Ids are drawn without replacement from the readable adj-noun-NNN space and
+# spill over into a wider adj-noun-NNNNNN space once that runs out, so large
+# batches never spin on collision retries.
+
+import csv
+import hashlib
+import hmac
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# ---- Config ---- #
+ADJECTIVES = [
+    "happy", "sneaky", "brave", "gentle", "proud", "quick", "smart", "calm",
+    "mighty", "lazy", "wild", "eager", "tiny", "lucky", "bright", "cool"
+]
+
+NOUNS = [
+    "rider", "hawk", "pirate", "ninja", "panda", "wizard", "chef", "ranger",
+    "robot", "fox", "lion", "whale", "sloth", "otter", "ghost", "alien"
+]
+
+DEFAULT_MAX_TOKENS = 128_000
+INSERT_BATCH_SIZE = 10_000      # records per insert_many call
+PARALLEL_SIGN_MIN = 50_000      # below this, signing in-process is faster than a pool
+
+
+# ---- Id Spaces ---- #
+class IdScheme:
+    """adj-noun-N ids with N in [low, high), numbered 0..size-1."""
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self.numbers = high - low
+        self.size = len(ADJECTIVES) * len(NOUNS) * self.numbers
+
+    def format(self, index):
+        pair, number = divmod(index, self.numbers)
+        adj, noun = divmod(pair, len(NOUNS))
+        return f"{ADJECTIVES[adj]}-{NOUNS[noun]}-{self.low + number}"
+
+    def parse(self, user_id):
+        # Index of user_id in this scheme, or None if it belongs elsewhere
+        parts = user_id.split("-")
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+        adj, noun, number = parts[0], parts[1], int(parts[2])
+        if adj not in ADJECTIVES or noun not in NOUNS or not self.low <= number < self.high:
+            return None
+        return (ADJECTIVES.index(adj) * len(NOUNS) + NOUNS.index(noun)) * self.numbers + number - self.low
+
+
+READABLE_IDS = IdScheme(100, 1000)          # happy-fox-123, ~230k ids
+WIDE_IDS = IdScheme(100_000, 1_000_000)     # happy-fox-123456, ~230M ids
+
+
+def sample_from_scheme(scheme, n, existing, rng):
+    taken = {i for i in map(scheme.parse, existing) if i is not None}
+    available = scheme.size - len(taken)
+    if n >= available:
+        free = [i for i in range(scheme.size) if i not in taken]
+        rng.shuffle(free)
+        return [scheme.format(i) for i in free]
+
+    # Over-draw by the number taken so that, after filtering, n always remain
+    drawn = rng.sample(range(scheme.size), min(scheme.size, n + len(taken)))
+    return [scheme.format(i) for i in drawn if i not in taken][:n]
+
+
+def sample_user_ids(n, existing=(), rng=None):
+    """n distinct ids not in `existing`, readable ones first."""
+    rng = rng or random.Random()
+    ids = sample_from_scheme(READABLE_IDS, n, existing, rng)
+    if len(ids) < n:
+        ids += sample_from_scheme(WIDE_IDS, n - len(ids), existing, rng)
+    if len(ids) < n:
+        raise ValueError(f"Only {len(ids)} free user ids left, {n} requested")
+    return ids
+
+
+# ---- Signing ---- #
+def _sign_chunk(secret_key, user_ids):
+    base = hmac.new(secret_key, digestmod=hashlib.sha256)
+    tokens = []
+    for user_id in user_ids:
+        mac = base.copy()
+        mac.update(user_id.encode())
+        tokens.append(mac.hexdigest())
+    return tokens
+
+
+def sign_batch(secret_key, user_ids, workers=None):
+    """HMAC tokens for user_ids, in order, split across processes for big batches."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(user_ids) < PARALLEL_SIGN_MIN:
+        return _sign_chunk(secret_key, user_ids)
+
+    size = -(-len(user_ids) // workers)
+    chunks = [user_ids[i:i + size] for i in range(0, len(user_ids), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_sign_chunk, [secret_key] * len(chunks), chunks)
+        return [token for chunk in results for token in chunk]
+
+
+# ---- Credential Export ---- #
+class CredentialWriter:
+    """Appends user_id/token pairs to a .csv or .jsonl file as batches are created."""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = "csv" if path.endswith(".csv") else "jsonl"
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        if self.format == "csv":
+            self._csv = csv.writer(self._file)
+            if new_file:
+                self._csv.writerow(["user_id", "token", "role", "createdDate"])
+
+    def write(self, users):
+        for user_id, record in users.items():
+            if self.format == "csv":
+                self._csv.writerow([user_id, record["token"], record["role"], record["createdDate"]])
+            else:
+                self._file.write(json.dumps({
+                    "user_id": user_id,
+                    "token": record["token"],
+                    "role": record["role"],
+                    "createdDate": record["createdDate"],
+                }) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+# ---- Provisioning ---- #
+def new_user_record(token, now, role="user", max_tokens=DEFAULT_MAX_TOKENS):
+    return {
+        "token": token,
+        "role": role,
+        "active": True,
+        "used_tokens": 0,
+        "max_tokens": max_tokens,
+        "createdDate": now,
+    }
+
+
+def provision_users(store, n, secret_key, export_path=None, batch_size=INSERT_BATCH_SIZE,
+                    workers=None, max_tokens=DEFAULT_MAX_TOKENS, rng=None):
+    """Create n users in `store` and optionally export their credentials; returns the new ids."""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    user_ids = sample_user_ids(n, store.user_ids(), rng)
+    tokens = sign_batch(secret_key, user_ids, workers)
+
+    writer = CredentialWriter(export_path) if export_path else None
+    try:
+        for start in range(0, n, batch_size):
+            batch = {
+                user_id: new_user_record(token, now, max_tokens=max_tokens)
+                for user_id, token in zip(user_ids[start:start + batch_size], tokens[start:start + batch_size])
+            }
+            store.insert_many(batch)
+            if writer:
+                writer.write(batch)
+    finally:
+        if writer:
+            writer.close()
+    return user_ids
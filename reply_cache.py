@@ -0,0 +1,146 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+### ---- Cache Config ---- ###
+REPLY_CACHE_TTL = 7 * 24 * 3600         # seconds a cached reply stays valid
+REPLY_CACHE_MEMORY_ENTRIES = 2_000
+REPLY_CACHE_DISK_ENTRIES = 50_000
+REPLY_CACHE_MAX_MESSAGES = 2            # system prompt + the opening user turn
+REPLY_CACHE_PRUNE_EVERY = 100           # stores between disk expiry/size sweeps
+
+
+def normalize_text(text):
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model, params, messages):
+    # Whitespace and case differences in the conversation should not split cache entries
+    payload = {
+        "model": model,
+        "params": params,
+        "messages": [
+            [m["role"], m["content"] if m["role"] == "system" else normalize_text(m["content"])]
+            for m in messages
+        ],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+### ---- Reply Cache ---- ###
+class ReplyCache:
+    """Two-tier cache of model replies: an in-memory LRU in front of a
+    SQLite table that survives restarts. Entries expire after `ttl`."""
+
+    def __init__(self, path, ttl=REPLY_CACHE_TTL, memory_entries=REPLY_CACHE_MEMORY_ENTRIES,
+                 disk_entries=REPLY_CACHE_DISK_ENTRIES, max_messages=REPLY_CACHE_MAX_MESSAGES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()    # key -> (reply, expires_at)
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+        self.evictions = 0
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS replies (
+                    key TEXT PRIMARY KEY,
+                    reply TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS replies_created ON replies (created)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def cacheable(self, messages):
+        return len(messages) <= self.max_messages
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                reply, expires = entry
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return reply
+                del self._memory[key]
+                self.expired += 1
+
+        row = self._conn().execute("SELECT reply, expires FROM replies WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] > now:
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, row[0], row[1])
+            return row[0]
+
+        with self._lock:
+            self.misses += 1
+            if row is not None:
+                self.expired += 1
+        return None
+
+    def put(self, key, reply):
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self.stores += 1
+            prune = self.stores % REPLY_CACHE_PRUNE_EVERY == 0
+            self._remember(key, reply, expires)
+
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO replies VALUES (?, ?, ?, ?)", (key, reply, now, expires))
+            if not prune:
+                return
+            conn.execute("DELETE FROM replies WHERE expires <= ?", (now,))
+            # Keep only the newest disk_entries replies
+            cur = conn.execute(
+                "DELETE FROM replies WHERE key IN ("
+                "SELECT key FROM replies ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,),
+            )
+            if cur.rowcount > 0:
+                with self._lock:
+                    self.evictions += cur.rowcount
+
+    def _remember(self, key, reply, expires):
+        self._memory[key] = (reply, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
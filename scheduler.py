@@ -0,0 +1,260 @@
+import asyncio
+import time
+from collections import deque
+
+### ---- Scheduler Config ---- ###
+DEFAULT_RPM = 500               # requests per minute allowed upstream
+DEFAULT_TPM = 200_000           # prompt + reply tokens per minute allowed upstream
+STATUS_INTERVAL = 1.0           # seconds between queue updates shown to a waiting user
+COALESCE_GRACE_SECONDS = 2.0    # how long a finished turn still answers duplicate submits
+
+
+### ---- Token Buckets ---- ###
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` units a second up to one minute's worth."""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount):
+        # Seconds until `amount` is available; requests bigger than the bucket wait for a full one
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+### ---- Scheduler ---- ###
+class Scheduler:
+    """Orders chat turns in front of the OpenAI call.
+
+    Each user holds a lock for the whole turn, so their turns apply to the
+    history one at a time and in order. Requests then wait in a single FIFO
+    for room in the requests- and tokens-per-minute buckets. Since a user can
+    only have one request in that queue, FIFO order serves users round-robin
+    and one busy user cannot crowd out the rest."""
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, clock=time.monotonic):
+        self._requests = TokenBucket(rpm, clock) if rpm else None     # 0 disables a limit
+        self._tokens = TokenBucket(tpm, clock) if tpm else None
+        self._user_locks = {}       # user_id -> [asyncio.Lock, tickets holding or waiting]
+        self._queue = deque()       # tickets waiting for admission, head first
+        self.admitted = 0
+        self.waited_seconds = 0.0
+
+    def ticket(self, user_id):
+        return Ticket(self, user_id)
+
+    def _admission_delay(self, tokens):
+        delay = 0.0
+        if self._requests:
+            delay = max(delay, self._requests.delay(1))
+        if self._tokens:
+            delay = max(delay, self._tokens.delay(tokens))
+        return delay
+
+    def _admit(self, ticket):
+        if self._requests:
+            self._requests.take(1)
+        if self._tokens:
+            self._tokens.take(ticket.tokens)
+        self._queue.popleft()
+        self.admitted += 1
+        self.waited_seconds += time.monotonic() - ticket.queued_at
+        if self._queue:
+            self._queue[0]._wake.set()
+
+    def _leave_queue(self, ticket):
+        was_head = self._queue and self._queue[0] is ticket
+        self._queue.remove(ticket)
+        if was_head and self._queue:
+            self._queue[0]._wake.set()
+
+    def stats(self):
+        return {
+            "queued": len(self._queue),
+            "users_active": len(self._user_locks),
+            "admitted": self.admitted,
+            "mean_wait_ms": round(self.waited_seconds / self.admitted * 1000, 3) if self.admitted else 0.0,
+        }
+
+
+class Ticket:
+    """One chat turn's place in the scheduler; always release() it when the turn ends."""
+
+    def __init__(self, scheduler, user_id):
+        self._scheduler = scheduler
+        self.user_id = user_id
+        self.tokens = 0
+        self.created_at = time.monotonic()
+        self.queued_at = None
+        self._wake = asyncio.Event()
+        self._lock = None
+        self._holds_lock = False
+        self._queued = False
+        self._deferred = []
+
+    @property
+    def waited(self):
+        return time.monotonic() - self.created_at
+
+    @property
+    def ahead(self):
+        # Requests in the admission queue in front of this one
+        return self._scheduler._queue.index(self) if self._queued else 0
+
+    async def wait_user(self, timeout=None):
+        """Wait for the user's earlier turns to finish; False if `timeout` passed first."""
+        if self._lock is None:
+            entry = self._scheduler._user_locks.setdefault(self.user_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            self._lock = entry[0]
+        try:
+            await asyncio.wait_for(self._lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._holds_lock = True
+        return True
+
+    async def wait_admission(self, tokens, timeout=None):
+        """Wait for a turn in the rate limits; False if `timeout` passed first."""
+        scheduler = self._scheduler
+        if not self._queued:
+            self.tokens = tokens
+            self.queued_at = time.monotonic()
+            scheduler._queue.append(self)
+            self._queued = True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = None
+            if scheduler._queue[0] is self:
+                delay = scheduler._admission_delay(self.tokens)
+                if delay <= 0:
+                    scheduler._admit(self)
+                    self._queued = False
+                    return True
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if delay is None or (remaining is not None and remaining < delay):
+                delay = remaining
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def defer(self, callback):
+        """Run `callback` on release(), e.g. to drop a lock taken for this turn elsewhere."""
+        self._deferred.append(callback)
+
+    def release(self):
+        while self._deferred:
+            self._deferred.pop()()
+        scheduler = self._scheduler
+        if self._queued:
+            scheduler._leave_queue(self)
+            self._queued = False
+        if self._lock is None:
+            return
+        if self._holds_lock:
+            self._lock.release()
+            self._holds_lock = False
+        entry = scheduler._user_locks.get(self.user_id)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del scheduler._user_locks[self.user_id]
+        self._lock = None
+
+
+### ---- Single Flight ---- ###
+class Flight:
+    """Updates of one in-flight chat turn, replayed to duplicate submissions."""
+
+    def __init__(self):
+        self.updates = []
+        self.done = False
+        self.committed = False      # the turn's reply was saved; only then is it replayed after finishing
+        self.finished_at = None
+        self._changed = asyncio.Event()
+
+    def publish(self, update):
+        self.updates.append(update)
+        self._notify()
+
+    def close(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self):
+        # Each output replaces the last in the UI, so a follower that falls behind skips to the newest
+        seen = 0
+        while True:
+            changed = self._changed
+            if len(self.updates) > seen:
+                seen = len(self.updates)
+                yield self.updates[-1]
+                continue
+            if self.done:
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """Coalesces identical submissions so they share one upstream request and one history append."""
+
+    def __init__(self, grace=COALESCE_GRACE_SECONDS):
+        self.grace = grace
+        self._flights = {}          # key -> Flight, running or finished within `grace`
+        self._finished = deque()    # (finished_at, key, flight) in finishing order
+        self.coalesced = 0
+
+    def join(self, key):
+        """Returns (flight, leader); only the leader runs the turn and publishes to the flight."""
+        self._expire()
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight, False
+        flight = self._flights[key] = Flight()
+        return flight, True
+
+    def finish(self, key, flight):
+        flight.close()
+        if flight.committed:
+            self._finished.append((flight.finished_at, key, flight))
+        elif self._flights.get(key) is flight:
+            del self._flights[key]  # an error or refusal is not replayed; a retry runs the turn again
+        self._expire()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.grace
+        while self._finished and self._finished[0][0] <= cutoff:
+            _, key, flight = self._finished.popleft()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        in_flight = sum(not flight.done for flight in self._flights.values())
+        return {"in_flight": in_flight, "coalesced": self.coalesced}
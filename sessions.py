@@ -0,0 +1,149 @@
+import json
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+### ---- Session Config ---- ###
+SESSION_MEMORY_BUDGET = 256 * 1024 * 1024   # bytes across hot and idle sessions
+SESSION_HOT_LIMIT = 200                     # sessions kept as live TokenHistory objects
+SESSION_IDLE_SECONDS = 300                  # hot sessions untouched this long get compacted
+MESSAGE_OVERHEAD_BYTES = 200                # rough per-message cost of a dict in a deque
+
+ROLES = tuple(sys.intern(role) for role in ("system", "user", "assistant"))
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+
+### ---- Compact Idle Sessions ---- ###
+class CompactSession:
+    """An idle session packed into one compressed blob plus per-message role
+    codes and token counts, so rehydrating it never re-runs the tokenizer."""
+
+    __slots__ = ("roles", "counts", "blob", "last_used")
+
+    def __init__(self, history, last_used):
+        self.roles = bytes(ROLE_CODES[m["role"]] for m in history)
+        self.counts = array("I", history.counts())
+        self.blob = zlib.compress(json.dumps([m["content"] for m in history]).encode("utf-8"))
+        self.last_used = last_used
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + len(self.roles) + self.counts.itemsize * len(self.counts)
+
+    def inflate(self, history):
+        contents = json.loads(zlib.decompress(self.blob))
+        for code, content, tokens in zip(self.roles, contents, self.counts):
+            history.append({"role": ROLES[code], "content": content}, tokens)
+        return history
+
+
+### ---- Session Manager ---- ###
+class SessionManager:
+    """Bounded, tiered replacement for a plain user_id -> history dict.
+
+    Recently used sessions stay hot as TokenHistory objects. Sessions that go
+    idle or fall out of the hot LRU are compacted, and once the memory budget
+    is exceeded the least recently used ones are dropped entirely; `loader`
+    rebuilds those from the transcript the next time they are needed."""
+
+    def __init__(self, loader, new_history, memory_budget=SESSION_MEMORY_BUDGET,
+                 hot_limit=SESSION_HOT_LIMIT, idle_seconds=SESSION_IDLE_SECONDS, lock=None):
+        self.loader = loader
+        self.new_history = new_history
+        self.memory_budget = memory_budget
+        self.hot_limit = hot_limit
+        self.idle_seconds = idle_seconds
+        self._lock = lock or threading.RLock()
+        self._hot = OrderedDict()       # user_id -> (history, last_used), LRU order
+        self._idle = OrderedDict()      # user_id -> CompactSession, LRU order
+        self._idle_bytes = 0
+        self.hits = 0
+        self.idle_hits = 0
+        self.misses = 0
+        self.compactions = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _hot_bytes(history):
+        return history.chars + MESSAGE_OVERHEAD_BYTES * len(history)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._hot.pop(user_id, None)
+            if entry is not None:
+                self.hits += 1
+                history = entry[0]
+            else:
+                compact = self._idle.pop(user_id, None)
+                if compact is not None:
+                    self.idle_hits += 1
+                    self._idle_bytes -= compact.nbytes
+                    history = compact.inflate(self.new_history())
+                else:
+                    self.misses += 1
+                    history = None
+
+            if history is not None:
+                self._hot[user_id] = (history, time.monotonic())
+                self._enforce()
+                return history
+
+        # Rehydrate outside the lock; the loader reads the transcript from disk
+        history = self.loader(user_id)
+        return self.put(user_id, history)
+
+    def put(self, user_id, history):
+        with self._lock:
+            compact = self._idle.pop(user_id, None)
+            if compact is not None:
+                self._idle_bytes -= compact.nbytes
+            self._hot.pop(user_id, None)
+            self._hot[user_id] = (history, time.monotonic())
+            self._enforce()
+            return history
+
+    def _compact(self, user_id, history, last_used):
+        compact = CompactSession(history, last_used)
+        self._idle[user_id] = compact
+        self._idle_bytes += compact.nbytes
+        self.compactions += 1
+
+    def _enforce(self):
+        now = time.monotonic()
+        while self._hot:
+            user_id, (history, last_used) = next(iter(self._hot.items()))
+            if len(self._hot) <= self.hot_limit and now - last_used < self.idle_seconds:
+                break
+            del self._hot[user_id]
+            self._compact(user_id, history, last_used)
+
+        hot_bytes = sum(self._hot_bytes(history) for history, _ in self._hot.values())
+        while self._idle and hot_bytes + self._idle_bytes > self.memory_budget:
+            _, compact = self._idle.popitem(last=False)
+            self._idle_bytes -= compact.nbytes
+            self.evictions += 1
+
+        # Never evict the session that was just touched
+        while len(self._hot) > 1 and hot_bytes > self.memory_budget:
+            _, (history, _) = self._hot.popitem(last=False)
+            hot_bytes -= self._hot_bytes(history)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.idle_hits + self.misses
+            return {
+                "hot_sessions": len(self._hot),
+                "idle_sessions": len(self._idle),
+                "hot_bytes": sum(self._hot_bytes(history) for history, _ in self._hot.values()),
+                "idle_bytes": self._idle_bytes,
+                "hits": self.hits,
+                "idle_hits": self.idle_hits,
+                "misses": self.misses,
+                "compactions": self.compactions,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.idle_hits) / lookups if lookups else 0.0,
+            }
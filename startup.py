@@ -0,0 +1,157 @@
+# startup.py
+#
+# Cold-start helpers for chatbot-server.py: a per-phase startup profiler and
+# tokenizer loading from a vendored cache, so a restart never has to fetch
+# BPE files over the network. The server refuses to start when the cache is
+# missing instead of downloading. Populate it once on a machine with network
+# access and ship the directory with the code:
+#
+#   python startup.py --vendor-tokenizer
+#   python startup.py --check       # time loading the encoding from the cache
+
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+
+# ---- Config ---- #
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKENIZER_MODEL = "gpt-4"
+TOKENIZER_CACHE_DIR = os.path.join(REPO_DIR, "tiktoken-cache")
+TOKENIZER_BPE_URLS = {  # tiktoken caches each file under sha1(url)
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+}
+DEFAULT_STARTUP_BUDGET = 0.0  # seconds until the port is bound, 0 = no budget
+
+
+# ---- Profiler ---- #
+class StartupProfiler:
+    """Records how long each startup phase took.
+
+    mark(name) closes a phase that ran since the previous mark, so module-level
+    setup only needs a line after each step. Work done after the port is bound
+    goes through background(name) and is reported separately, as it does not
+    count against the budget."""
+
+    def __init__(self, budget=DEFAULT_STARTUP_BUDGET):
+        self.budget = budget
+        self.start = time.perf_counter()
+        self._last = self.start
+        self._lock = threading.Lock()
+        self.phases = []        # [(name, seconds)] until ready()
+        self.background_phases = []
+        self.ready_seconds = None
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def background(self, name):
+        return _BackgroundPhase(self, name)
+
+    def ready(self):
+        """Call once the server accepts connections; returns False when over budget."""
+        self.ready_seconds = time.perf_counter() - self.start
+        return not self.budget or self.ready_seconds <= self.budget
+
+    def report(self):
+        with self._lock:
+            background = dict(self.background_phases)
+        return {
+            "ready_seconds": None if self.ready_seconds is None else round(self.ready_seconds, 3),
+            "budget_seconds": self.budget or None,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases},
+            "background": {name: round(seconds, 3) for name, seconds in background.items()},
+        }
+
+    def summary(self):
+        parts = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        line = f"🚀 Ready in {self.ready_seconds:.2f}s ({parts})"
+        if self.budget and self.ready_seconds > self.budget:
+            line += f" ⚠️ over the {self.budget:.1f}s startup budget"
+        return line
+
+
+class _BackgroundPhase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        with self.profiler._lock:
+            self.profiler.background_phases.append((self.name, time.perf_counter() - self.start))
+
+
+# ---- Tokenizer ---- #
+def use_vendored_tokenizer(cache_dir=TOKENIZER_CACHE_DIR):
+    # An explicit TIKTOKEN_CACHE_DIR wins; otherwise read the copy shipped with the code
+    if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(cache_dir):
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+
+def tokenizer_cache_file(model=TOKENIZER_MODEL):
+    import tiktoken
+    url = TOKENIZER_BPE_URLS[tiktoken.encoding_name_for_model(model)]
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", TOKENIZER_CACHE_DIR)
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+
+
+def require_tokenizer_cache(model=TOKENIZER_MODEL):
+    """Fails fast when the BPE file is not cached, so tiktoken never downloads it."""
+    use_vendored_tokenizer()
+    path = tokenizer_cache_file(model)
+    if not os.path.isfile(path):
+        raise RuntimeError(
+            f"Tokenizer cache missing: {path} ({model}). "
+            f"Run `python startup.py --vendor-tokenizer` where the network is reachable "
+            f"and deploy {TOKENIZER_CACHE_DIR} with the code."
+        )
+    return path
+
+
+def _encoding_for_model(model):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        raise RuntimeError(f"Could not load the {model} tokenizer ({e}).") from e
+
+
+def load_encoding(model=TOKENIZER_MODEL):
+    require_tokenizer_cache(model)
+    return _encoding_for_model(model)
+
+
+def vendor_tokenizer(model=TOKENIZER_MODEL, cache_dir=TOKENIZER_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    _encoding_for_model(model)  # the only place allowed to fetch
+    return sorted(os.listdir(cache_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare and check the server's cold start")
+    parser.add_argument("--vendor-tokenizer", action="store_true", help=f"download the BPE files into {TOKENIZER_CACHE_DIR}")
+    parser.add_argument("--check", action="store_true", help="time loading the encoding from the cache")
+    args = parser.parse_args()
+
+    if args.vendor_tokenizer:
+        files = vendor_tokenizer()
+        print(f"✅ Tokenizer cached in {TOKENIZER_CACHE_DIR}: {', '.join(files)}")
+    if args.check or not args.vendor_tokenizer:
+        start = time.perf_counter()
+        try:
+            encoding = load_encoding()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Loaded {encoding.name} in {time.perf_counter() - start:.2f}s "
+              f"from {os.environ['TIKTOKEN_CACHE_DIR']}")
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from filelock import FileLock, Timeout
+from user_store import SqliteUserStore
+
+### ---- State Config ---- ###
+# STATE_BACKEND is "local" (one server process) or "shared" (several workers on one host)
+DEFAULT_STATE_BACKEND = "local"
+LOCK_DIR = os.path.join("chats", "locks")
+LOCK_POLL_INTERVAL = 0.02
+
+
+def _release_nothing():
+    pass
+
+
+### ---- Local Backend ---- ###
+class LocalState:
+    """Everything lives in this process; the scheduler's per-user lock is enough."""
+
+    shared = False
+
+    async def lock_user(self, user_id, timeout=None):
+        return _release_nothing
+
+    def stored_used_tokens(self, user_id, user):
+        return user.get("used_tokens", 0)
+
+
+### ---- Shared Backend ---- ###
+class SharedFileState:
+    """State shared by worker processes on one host.
+
+    The transcript files and the SQLite user, usage and reply-cache databases
+    are already safe to share; what is added here is a per-user file lock
+    held for the whole turn, so two workers never interleave one user's
+    turns, and used_tokens read from the store rather than this process's
+    snapshot, so quota checks see usage billed by every worker. Sessions
+    cached in memory are checked against the transcript (see
+    TranscriptStore.version) and reloaded when another worker has added to it."""
+
+    shared = True
+
+    def __init__(self, store, lock_dir=LOCK_DIR, poll_interval=LOCK_POLL_INTERVAL):
+        if not isinstance(store, SqliteUserStore):
+            raise ValueError("STATE_BACKEND=shared needs the SQLite user store")
+        self.store = store
+        self.lock_dir = lock_dir
+        self.poll_interval = poll_interval
+        os.makedirs(lock_dir, exist_ok=True)
+
+    async def lock_user(self, user_id, timeout=None):
+        """Returns a release function, or None if `timeout` passed first."""
+        # Non-blocking attempts keep this cancel-safe: a cancelled waiter never acquires later
+        lock = FileLock(os.path.join(self.lock_dir, f"{user_id}.lock"), thread_local=False)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                lock.acquire(blocking=False)
+                return lock.release
+            except Timeout:
+                pass
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    def stored_used_tokens(self, user_id, user):
+        record = self.store.get(user_id)
+        return (record or user).get("used_tokens", 0)
+
+
+### ---- Factory ---- ###
+def open_state_backend(store, kind=None):
+    kind = kind or os.environ.get("STATE_BACKEND", DEFAULT_STATE_BACKEND)
+    if kind == "local":
+        return LocalState()
+    if kind == "shared":
+        return SharedFileState(store)
+    raise ValueError(f"Unknown state backend: {kind!r}")
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openai import FakeConfig, start_fake_openai  # noqa: E402
+
+
+@pytest.fixture
+def fake_openai():
+    """Starts fake_openai.py endpoints for a test: fake_openai(**config) -> (config, base_url)."""
+    servers = []
+
+    def start(**config):
+        cfg = FakeConfig(**config)
+        server, base_url = start_fake_openai(cfg)
+        servers.append(server)
+        return cfg, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
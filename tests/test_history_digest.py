@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from context_window import COMPACT
+from history_digest import DIGEST_HEADER, ExtractiveDigest, ModelDigest, compact_history, compaction_thresholds
+from prompts import prepare_turn
+from scheduler import Scheduler
+from token_history import MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS, TokenHistory
+from transcripts import TranscriptStore
+from upstream import Upstream
+
+SYSTEM_TOKENS = MESSAGE_OVERHEAD_TOKENS + 50
+REPLY_TOKENS = 500
+
+
+def count_tokens(text):
+    return len(text.split())  # stands in for tiktoken so the tests run offline
+
+
+class CountingDigest(ExtractiveDigest):
+    calls = 0
+
+    async def __call__(self, previous, messages, max_tokens=None):
+        self.calls += 1
+        return await super().__call__(previous, messages, max_tokens)
+
+
+def available_tokens(max_tokens):
+    return max_tokens - REPLY_TOKENS - REPLY_PRIMING_TOKENS - SYSTEM_TOKENS
+
+
+async def compact_and_store(store, history, summarize, thresholds):
+    if await compact_history(history, summarize, *thresholds) is not None:
+        store.append_digest("u", history[0]["content"], len(history) - 1)
+
+
+def test_long_conversation_stays_bounded_and_reloads(tmp_path):
+    turns, max_tokens = 60, 8_000
+    available = available_tokens(max_tokens)
+    thresholds = compaction_thresholds(available, compact_at=4_000, keep=1_000, digest_max=300)
+    trigger = thresholds[0]
+    summarize = CountingDigest(count_tokens)
+    store = TranscriptStore(str(tmp_path / "chats"))
+    history = TokenHistory(count_tokens)
+    largest = 0
+
+    async def converse():
+        nonlocal largest
+        for i in range(turns):
+            await compact_and_store(store, history, summarize, thresholds)
+            prompt = f"Turn {i}: is claim number {i} supported by good evidence? " + "Why do people believe it? " * 20
+            messages, prompt_tokens = prepare_turn(history, prompt, SYSTEM_TOKENS, max_tokens, COMPACT)
+            assert messages is not None, f"turn {i} refused at {prompt_tokens} tokens"
+            largest = max(largest, prompt_tokens)
+            reply = {"role": "assistant", "content": f"What would convince you about claim {i}? " * 15}
+            history.append(reply)
+            store.append("u", [history[-2], reply])
+        await compact_and_store(store, history, summarize, thresholds)  # as the next turn would
+
+    try:
+        asyncio.run(converse())
+        reloaded = TokenHistory(count_tokens)
+        tail, _ = store.read_tail("u", available, reloaded.message_tokens)
+        for message, tokens in tail:
+            reloaded.append(message, tokens)
+        calls = summarize.calls
+        asyncio.run(compact_history(reloaded, summarize, *thresholds))
+    finally:
+        store.close()
+
+    assert largest <= trigger + 2_000
+    assert 0 < calls <= turns // 5
+    assert summarize.calls == calls, "reload generated the digest again"
+    assert list(reloaded) == list(history)
+    assert history[0]["content"].startswith(DIGEST_HEADER)
+    assert "Turn 0:" in history[0]["content"]
+
+
+@pytest.mark.parametrize("max_tokens", [4_000, 8_000, 32_000])
+def test_small_budgets_do_not_digest_every_few_turns(max_tokens):
+    turns = 200
+    thresholds = compaction_thresholds(available_tokens(max_tokens))
+    if thresholds is None:
+        return  # too small to compact, the history is truncated instead
+    summarize = CountingDigest(count_tokens)
+    history = TokenHistory(count_tokens)
+
+    async def converse():
+        for i in range(turns):
+            await compact_history(history, summarize, *thresholds)
+            history.append({"role": "user", "content": f"Turn {i}: " + "why is that so? " * 10})
+            history.append({"role": "assistant", "content": f"Claim {i}: " + "what supports this view? " * 75})
+
+    asyncio.run(converse())
+
+    assert summarize.calls <= turns // 5
+
+
+def test_model_digest_waits_for_admission(fake_openai):
+    cfg, base_url = fake_openai(latency=0.0, reply="- Learner asked about ashwagandha")
+    digest = ModelDigest(Upstream(["sk-a"], base_url), count_tokens, max_tokens=300)
+    scheduler = Scheduler(rpm=100, tpm=100_000)
+    messages = [{"role": "user", "content": "Does ashwagandha work?"},
+                {"role": "assistant", "content": "What evidence have you seen?"}]
+
+    async def run():
+        ticket = scheduler.ticket("u")
+        try:
+            text = await digest(None, messages, admit=ticket.wait_admission)
+        finally:
+            ticket.release()
+        return text, ticket.tokens
+
+    text, admitted_tokens = asyncio.run(run())
+
+    assert text == cfg.reply
+    assert scheduler.admitted == 1
+    assert admitted_tokens > 300 + REPLY_PRIMING_TOKENS
+    assert digest.generated == 1
+
+
+def test_model_digest_falls_back_when_upstream_fails(fake_openai):
+    cfg, base_url = fake_openai(latency=0.0, error_rate=1.0, error_statuses=(503,))
+    extractive = ExtractiveDigest(count_tokens)
+    digest = ModelDigest(Upstream(["sk-a"], base_url, max_attempts=1), count_tokens, fallback=extractive)
+    messages = [{"role": "user", "content": "Does ashwagandha work?"}]
+
+    text = asyncio.run(digest("- Learner: hello", messages))
+
+    assert text == asyncio.run(extractive("- Learner: hello", messages))
+    assert digest.fallbacks == 1
+    assert digest.generated == 0
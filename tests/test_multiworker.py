@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import pytest
+
+from startup import require_tokenizer_cache
+
+try:
+    require_tokenizer_cache()
+except RuntimeError as e:
+    pytest.skip(str(e), allow_module_level=True)
+
+from fake_openai import FakeConfig, start_fake_openai  # noqa: E402
+from user_store import SqliteUserStore  # noqa: E402
+
+USER = "check-user-001"
+SECRET = "check-secret"
+WORKERS = 2
+TURNS = 6
+
+
+def serve_turns(conn, workdir):
+    # Runs in its own process, like a launched worker, and serves turns sent over the pipe until None
+    os.chdir(workdir)
+    from benchmark import load_server
+    server = load_server()
+    loop = asyncio.new_event_loop()
+
+    async def turn(user_id, token, prompt):
+        last = None
+        async for last in server.chat(prompt, user_id, token, []):
+            pass
+        history = server.SESSION_STATE.get(user_id)
+        return last[1], [m["content"] for m in history]
+
+    try:
+        while (message := conn.recv()) is not None:
+            conn.send(loop.run_until_complete(turn(*message)))
+    finally:
+        server.LEDGER.close()
+        server.TRANSCRIPTS.close()
+        loop.run_until_complete(loop.shutdown_asyncgens())  # reply streams left suspended by the HTTP client
+        leftover = asyncio.all_tasks(loop)
+        if leftover:
+            for task in leftover:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*leftover, return_exceptions=True))
+        loop.close()
+        conn.send(len(leftover))
+
+
+@pytest.fixture(scope="module")
+def run(tmp_path_factory):
+    """Sequential turns round-robin across workers, then one simultaneous turn per worker, for one user."""
+    workdir = str(tmp_path_factory.mktemp("workers"))
+    fake_server, base_url = start_fake_openai(FakeConfig(latency=0.01, seed=1))
+    token = hmac.new(SECRET.encode(), USER.encode(), hashlib.sha256).hexdigest()
+    SqliteUserStore(os.path.join(workdir, "users.db")).insert_many({USER: {
+        "token": token, "role": "user", "active": True, "used_tokens": 0, "max_tokens": 128_000,
+        "createdDate": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }})
+    result = {"sequential": [], "burst": [f"Concurrent turn {w}" for w in range(WORKERS)]}
+
+    with pytest.MonkeyPatch.context() as env:
+        for name, value in {"APIK": "sk-check", "SECT": SECRET, "OPENAI_BASE_URL": base_url,
+                            "USER_STORE": "sqlite:users.db", "STATE_BACKEND": "shared",
+                            "REPLY_CACHE": "off", "METRICS": "off"}.items():
+            env.setenv(name, value)
+        ctx = multiprocessing.get_context("spawn")
+        pipes, procs = [], []
+        for _ in range(WORKERS):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=serve_turns, args=(child, workdir), daemon=True)
+            proc.start()
+            pipes.append(parent)
+            procs.append(proc)
+
+    try:
+        for i in range(TURNS):
+            pipe = pipes[i % WORKERS]
+            pipe.send((USER, token, f"Consistency turn {i}"))
+            result["sequential"].append(pipe.recv())
+        for pipe, prompt in zip(pipes, result["burst"]):
+            pipe.send((USER, token, prompt))
+        result["burst_errors"] = [pipe.recv()[0] for pipe in pipes]
+    finally:
+        for pipe in pipes:
+            pipe.send(None)
+        result["leftover_tasks"] = [pipe.recv() for pipe in pipes]
+        for proc in procs:
+            proc.join(timeout=10)
+        fake_server.shutdown()
+
+    with open(os.path.join(workdir, "chats", f"{USER}.jsonl")) as f:
+        result["transcript"] = [json.loads(line) for line in f if line.strip()]
+    result["used_tokens"] = SqliteUserStore(os.path.join(workdir, "users.db")).get(USER)["used_tokens"]
+    with sqlite3.connect(os.path.join(workdir, "usage.db")) as conn:
+        result["billed"] = conn.execute("SELECT SUM(prompt_tokens + completion_tokens) FROM usage_daily").fetchone()[0]
+    return result
+
+
+def test_each_worker_sees_the_turns_served_by_the_others(run):
+    prompts = [f"Consistency turn {i}" for i in range(TURNS)]
+    for i, (error, history) in enumerate(run["sequential"]):
+        assert not error
+        assert history[0::2] == prompts[:i + 1]
+
+
+def test_simultaneous_turns_land_one_after_another(run):
+    assert not any(run["burst_errors"])
+    roles = [record["role"] for record in run["transcript"]]
+    assert roles == ["user", "assistant"] * (TURNS + WORKERS)
+    prompts = [record["content"] for record in run["transcript"] if record["role"] == "user"]
+    assert prompts[:TURNS] == [f"Consistency turn {i}" for i in range(TURNS)]
+    assert sorted(prompts[TURNS:]) == sorted(run["burst"])
+
+
+def test_usage_from_every_worker_reaches_the_shared_store(run):
+    assert run["billed"] > 0
+    assert run["used_tokens"] == run["billed"]
+
+
+def test_workers_shut_down_without_pending_tasks(run):
+    assert run["leftover_tasks"] == [0] * WORKERS
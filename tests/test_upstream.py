@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from upstream import CircuitBreaker, Upstream, UpstreamError
+
+MESSAGES = [{"role": "user", "content": "Does ashwagandha work?"}]
+
+
+async def stream_text(upstream):
+    text = ""
+    async for chunk in upstream.stream_chat(model="fake", messages=MESSAGES, max_tokens=16):
+        if chunk.choices and chunk.choices[0].delta.content:
+            text += chunk.choices[0].delta.content
+    return text
+
+
+async def failure_kinds(upstream, requests):
+    kinds = []
+    for _ in range(requests):
+        try:
+            await stream_text(upstream)
+            kinds.append(None)
+        except UpstreamError as e:
+            kinds.append(e.kind)
+    return kinds
+
+
+def test_retries_injected_faults(fake_openai):
+    cfg, base_url = fake_openai(latency=0.0, error_rate=0.4, seed=3)
+    upstream = Upstream(["sk-a"], base_url, max_attempts=6, backoff_base=0.01, backoff_max=0.05,
+                        breaker=CircuitBreaker(threshold=0))
+
+    kinds = asyncio.run(failure_kinds(upstream, 30))
+
+    assert kinds == [None] * 30
+    assert cfg.errors > 0
+    assert upstream.retries == cfg.errors
+
+
+def test_circuit_opens_on_dead_upstream(fake_openai):
+    cfg, base_url = fake_openai(latency=0.0, error_rate=1.0, error_statuses=(503,))
+    upstream = Upstream(["sk-a"], base_url, max_attempts=1, breaker=CircuitBreaker(threshold=3, cooldown=60))
+
+    kinds = asyncio.run(failure_kinds(upstream, 6))
+
+    assert kinds == ["http_503"] * 3 + ["circuit_open"] * 3
+    assert cfg.requests == 3
+    assert upstream.breaker.state == "open"
+
+
+def test_cancelled_trial_does_not_keep_circuit_open(fake_openai):
+    cfg, base_url = fake_openai(latency=0.0, error_rate=1.0, error_statuses=(503,))
+    upstream = Upstream(["sk-a"], base_url, max_attempts=1, breaker=CircuitBreaker(threshold=1, cooldown=0.2))
+
+    async def run():
+        assert await failure_kinds(upstream, 1) == ["http_503"]
+        await asyncio.sleep(0.25)
+        cfg.latency = 1.0
+        trial = asyncio.create_task(stream_text(upstream))
+        await asyncio.sleep(0.1)
+        trial.cancel()
+        try:
+            await trial
+        except asyncio.CancelledError:
+            pass
+        cfg.latency, cfg.error_rate = 0.0, 0.0
+        return await failure_kinds(upstream, 1)
+
+    assert asyncio.run(run()) == [None]
+    assert upstream.breaker.state == "closed"
+
+
+def test_hedging_cuts_the_tail(fake_openai):
+    cfg, base_url = fake_openai(latency=0.01, slow_rate=0.2, slow_latency=1.0, seed=5)
+
+    async def p90(upstream):
+        latencies = []
+        for _ in range(30):
+            start = time.perf_counter()
+            await stream_text(upstream)
+            latencies.append(time.perf_counter() - start)
+        return sorted(latencies)[int(len(latencies) * 0.9)]
+
+    plain = asyncio.run(p90(Upstream(["sk-a"], base_url)))
+    hedged_upstream = Upstream(["sk-a"], base_url, hedge_after=0.1)
+    hedged = asyncio.run(p90(hedged_upstream))
+
+    assert hedged < plain / 2
+    assert hedged_upstream.hedge_wins > 0
+
+
+def test_revoked_key_is_set_aside(fake_openai):
+    cfg, base_url = fake_openai(latency=0.0, bad_keys={"sk-revoked"})
+    upstream = Upstream(["sk-revoked", "sk-good"], base_url, backoff_base=0.01)
+
+    kinds = asyncio.run(failure_kinds(upstream, 10))
+
+    assert kinds == [None] * 10
+    assert upstream.failures.get("rejected_key") == 1
+    assert upstream.keys.stats()["cooling_down"] == 1
+
+
+def test_request_timeout(fake_openai):
+    cfg, base_url = fake_openai(latency=1.0)
+    upstream = Upstream(["sk-a"], base_url, max_attempts=1, request_timeout=0.2)
+
+    start = time.perf_counter()
+    kinds = asyncio.run(failure_kinds(upstream, 1))
+
+    assert kinds == ["timeout"]
+    assert time.perf_counter() - start < 0.5
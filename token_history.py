@@ -0,0 +1,77 @@
+from collections import deque
+
+### ---- Token Constants ---- ###
+REPLY_PRIMING_TOKENS = 3            # every request is primed with <|start|>assistant
+MESSAGE_OVERHEAD_TOKENS = 4         # <|start|>{role}\n{content}<|end|>\n
+
+
+### ---- Token-Aware History ---- ###
+class TokenHistory:
+    """Chat history that encodes each message once, when it is appended,
+    and keeps a running token total so limit checks are O(1)."""
+
+    def __init__(self, count_tokens, messages=()):
+        self._count_tokens = count_tokens
+        self._messages = deque()
+        self._counts = deque()
+        self.total = 0
+        self.chars = 0                  # running content length, for memory accounting
+        self.extend(messages)
+
+    def message_tokens(self, message):
+        return MESSAGE_OVERHEAD_TOKENS + self._count_tokens(message["content"])
+
+    def append(self, message, tokens=None):
+        if tokens is None:
+            tokens = self.message_tokens(message)
+        self._messages.append(message)
+        self._counts.append(tokens)
+        self.total += tokens
+        self.chars += len(message["content"])
+        return tokens
+
+    def appendleft(self, message, tokens=None):
+        if tokens is None:
+            tokens = self.message_tokens(message)
+        self._messages.appendleft(message)
+        self._counts.appendleft(tokens)
+        self.total += tokens
+        self.chars += len(message["content"])
+        return tokens
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def pop(self):
+        self.total -= self._counts.pop()
+        message = self._messages.pop()
+        self.chars -= len(message["content"])
+        return message
+
+    def popleft(self):
+        self.total -= self._counts.popleft()
+        message = self._messages.popleft()
+        self.chars -= len(message["content"])
+        return message
+
+    def clear(self):
+        self._messages.clear()
+        self._counts.clear()
+        self.total = 0
+        self.chars = 0
+
+    def token_count(self, index):
+        return self._counts[index]
+
+    def counts(self):
+        return list(self._counts)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
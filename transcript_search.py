@@ -0,0 +1,245 @@
+# transcript_search.py
+#
+# Full-text search over chat transcripts for the admin dashboard, kept in a
+# SQLite FTS5 index. The server indexes each transcript's new lines after
+# every turn; existing transcripts are indexed once with:
+#
+#   python transcript_search.py --reindex --workers 8
+#   python transcript_search.py "ashwagandha testosterone"
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# ---- Config ---- #
+SEARCH_FILE = "search.db"
+SEARCH_PAGE_SIZE = 20
+SNIPPET_TOKENS = 16
+HIGHLIGHT = ("\x02", "\x03")   # snippet() match markers, replaced once the text is escaped
+MARKDOWN_SPECIAL = re.compile(r"([\\`*_{}\[\]<>()#+\-.!|~$])")
+ROWID_BLOCK = 2 ** 32           # each transcript's messages get rowids [id * ROWID_BLOCK, (id + 1) * ROWID_BLOCK)
+
+
+def read_records(path, start=0):
+    """(inode, end, rows) for the complete lines of a transcript from byte `start` on.
+
+    rows are (role, content, ts); `end` is just past the last complete line, so
+    a half-written last line is picked up by the next call instead."""
+    rows = []
+    try:
+        with open(path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            f.seek(start)
+            data = f.read()
+    except OSError:
+        return None, start, rows
+    end = start + data.rfind(b"\n") + 1
+    for line in data[:end - start].split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("role") in ("user", "assistant"):
+            rows.append((record["role"], record.get("content") or "", record.get("ts")))
+    return inode, end, rows
+
+
+def fts_query(text):
+    # Every word must match; quoting keeps punctuation like "?" or "-" from being FTS syntax
+    words = [w.replace('"', '""') for w in text.split()]
+    return " ".join(f'"{w}"' for w in words)
+
+
+def highlight(snippet, markdown=False):
+    # Matches in bold; markdown=True also escapes the message itself, for markdown table cells
+    if markdown:
+        snippet = MARKDOWN_SPECIAL.sub(r"\\\1", snippet)
+    return snippet.replace(HIGHLIGHT[0], "**").replace(HIGHLIGHT[1], "**")
+
+
+def _read_file(job):
+    user_id, path, start = job
+    return (user_id, start) + read_records(path, start)
+
+
+### ---- Search Index ---- ###
+class TranscriptIndex:
+    """FTS5 index of transcript messages plus how far each transcript has been read.
+
+    Indexing always resumes from the stored offset, so updates after each
+    turn, the bulk indexer and several worker processes can all write to it
+    without duplicating or missing messages. A transcript whose inode changed
+    (compacted or rewritten) is indexed again from the start. Each transcript
+    owns a block of rowids, so dropping its old rows is a rowid range delete
+    rather than a scan of the whole index."""
+
+    def __init__(self, path=SEARCH_FILE):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+                content, user_id UNINDEXED, role UNINDEXED, ts UNINDEXED,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS indexed (
+                user_id TEXT PRIMARY KEY, inode INTEGER, offset INTEGER,
+                id INTEGER, messages INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        if "id" not in {row[1] for row in conn.execute("PRAGMA table_info(indexed)")}:
+            self._upgrade(conn)
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS indexed_id ON indexed (id)")
+
+    @staticmethod
+    def _upgrade(conn):
+        # Indexes built before rowid blocks: their rows keep rowids below ROWID_BLOCK
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ALTER TABLE indexed ADD COLUMN id INTEGER")
+        conn.execute("ALTER TABLE indexed ADD COLUMN messages INTEGER NOT NULL DEFAULT 0")
+        counts = conn.execute("SELECT user_id, COUNT(*) FROM messages GROUP BY user_id").fetchall()
+        conn.executemany("UPDATE indexed SET messages = ? WHERE user_id = ?", [(n, uid) for uid, n in counts])
+        conn.execute("COMMIT")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _position(self, conn, user_id):
+        row = conn.execute("SELECT inode, offset FROM indexed WHERE user_id = ?", (user_id,)).fetchone()
+        return row or (None, 0)
+
+    def _apply(self, conn, user_id, inode, end, rows, reset):
+        row = conn.execute("SELECT id, messages FROM indexed WHERE user_id = ?", (user_id,)).fetchone()
+        block, count = row or (None, 0)
+        if block is None:
+            block = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM indexed").fetchone()[0]
+        if reset:
+            conn.execute(
+                "DELETE FROM messages WHERE rowid >= ? AND rowid < ?",
+                (block * ROWID_BLOCK, (block + 1) * ROWID_BLOCK),
+            )
+            # Rows indexed before rowid blocks; an empty range once the index was rebuilt
+            conn.execute("DELETE FROM messages WHERE rowid < ? AND user_id = ?", (ROWID_BLOCK, user_id))
+            count = 0
+        first = block * ROWID_BLOCK + count
+        conn.executemany(
+            "INSERT INTO messages (rowid, content, user_id, role, ts) VALUES (?, ?, ?, ?, ?)",
+            [(first + i, content, user_id, role, ts) for i, (role, content, ts) in enumerate(rows)],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO indexed (user_id, inode, offset, id, messages) VALUES (?, ?, ?, ?, ?)",
+            (user_id, inode, end, block, count + len(rows)),
+        )
+
+    def catch_up(self, user_id, path):
+        """Index whatever was appended to `path` since the last call; returns messages added."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            inode, offset = self._position(conn, user_id)
+            try:
+                reset = os.stat(path).st_ino != inode
+            except OSError:
+                conn.execute("ROLLBACK")
+                return 0
+            new_inode, end, rows = read_records(path, 0 if reset else offset)
+            self._apply(conn, user_id, new_inode, end, rows, reset and inode is not None)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def reindex(self, chat_dir, workers=None):
+        """Bulk-index every transcript in `chat_dir`, parsing files in parallel; returns messages added."""
+        conn = self._conn()
+        jobs = []
+        for name in sorted(os.listdir(chat_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            user_id = name[:-len(".jsonl")]
+            path = os.path.join(chat_dir, name)
+            inode, offset = self._position(conn, user_id)
+            try:
+                same_file = os.stat(path).st_ino == inode
+            except OSError:
+                continue
+            jobs.append((user_id, path, offset if same_file else 0))
+
+        added = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for user_id, start, inode, end, rows in pool.map(_read_file, jobs, chunksize=64):
+                if inode is None:
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Skip files the server indexed further while we were parsing
+                    old_inode, old_offset = self._position(conn, user_id)
+                    if old_inode == inode and old_offset != start:
+                        conn.execute("ROLLBACK")
+                        continue
+                    self._apply(conn, user_id, inode, end, rows, old_inode is not None and old_inode != inode)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                added += len(rows)
+        return added
+
+    def search(self, text, offset=0, limit=SEARCH_PAGE_SIZE, markdown=False):
+        """Best-ranked hits for `text` as (user_id, role, ts, snippet), plus the total number of hits.
+
+        Matches in the snippet are wrapped in **; with markdown=True the rest
+        of it is escaped, so it renders as typed."""
+        query = fts_query(text)
+        if not query:
+            return [], 0
+        conn = self._conn()
+        total = conn.execute("SELECT COUNT(*) FROM messages WHERE messages MATCH ?", (query,)).fetchone()[0]
+        rows = conn.execute(
+            "SELECT user_id, role, ts, snippet(messages, 0, ?, ?, '…', ?) FROM messages "
+            "WHERE messages MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+            (*HIGHLIGHT, SNIPPET_TOKENS, query, limit, offset),
+        ).fetchall()
+        return [(user_id, role, ts, highlight(snippet, markdown)) for user_id, role, ts, snippet in rows], total
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            "transcripts": conn.execute("SELECT COUNT(*) FROM indexed").fetchone()[0],
+            "messages": conn.execute("SELECT COALESCE(SUM(messages), 0) FROM indexed").fetchone()[0],
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search chat transcripts, or build the search index")
+    parser.add_argument("query", nargs="?", help="words to search for")
+    parser.add_argument("--reindex", action="store_true", help="index all transcripts not yet indexed")
+    parser.add_argument("--chat-dir", default="chats")
+    parser.add_argument("--index", default=SEARCH_FILE)
+    parser.add_argument("--workers", type=int, help="processes used to parse transcripts")
+    args = parser.parse_args()
+
+    index = TranscriptIndex(args.index)
+    if args.reindex:
+        added = index.reindex(args.chat_dir, args.workers)
+        print(f"✅ Indexed {added} messages, {index.stats()['transcripts']} transcripts in {args.index}")
+    if args.query:
+        hits, total = index.search(args.query)
+        print(f"{total} hits")
+        for user_id, role, ts, snippet in hits:
+            print(f"{user_id:<28} {role:<10} {snippet}")
@@ -0,0 +1,302 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+### ---- Transcript Config ---- ###
+FSYNC_BATCH = 8                 # fsync after this many appended records...
+FSYNC_INTERVAL = 2.0            # ...or once this many seconds have passed
+MAX_OPEN_FILES = 256
+LOCK_STRIPES = 64               # per-user locks, shared by users whose ids hash alike
+READ_BLOCK_SIZE = 64 * 1024
+DIGEST_ROLE = "digest"          # record summarizing earlier messages, see history_digest.py
+
+
+### ---- Append-Only Transcripts ---- ###
+class TranscriptStore:
+    """Per-user chat transcripts as append-only JSONL, one record per message.
+
+    Appends never rewrite earlier messages, so a crash can at worst tear the
+    last line, which readers skip and compaction drops; a transcript is only
+    rewritten once such a line was seen. Reads walk the file backwards so a
+    login only parses the tail it actually needs.
+
+    Writes, fsyncs and compaction run under the user's own (striped) lock;
+    `lock` only guards the table of open handles, so one user's fsync never
+    holds up another user's append."""
+
+    def __init__(self, chat_dir, fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL, lock=None, shared=False):
+        self.chat_dir = chat_dir
+        self.shared = shared            # other processes may append to or compact the same files
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._lock = lock or threading.Lock()
+        self._user_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._files = OrderedDict()     # user_id -> open append handle, LRU order
+        self._unsynced = {}             # user_id -> records written since last fsync
+        self._last_sync = {}
+        self._needs_compaction = set()
+        os.makedirs(chat_dir, exist_ok=True)
+
+    def _user_lock(self, user_id):
+        return self._user_locks[hash(user_id) % LOCK_STRIPES]
+
+    def path(self, user_id):
+        return os.path.join(self.chat_dir, f"{user_id}.jsonl")
+
+    def legacy_path(self, user_id):
+        return os.path.join(self.chat_dir, f"{user_id}.json")
+
+    def _migrate_legacy(self, user_id):
+        # Older deployments rewrote chats/{user_id}.json in full every turn
+        path, legacy = self.path(user_id), self.legacy_path(user_id)
+        if os.path.exists(path) or not os.path.exists(legacy):
+            return
+        with open(legacy, "r") as f:
+            messages = json.load(f)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            for msg in messages:
+                f.write(json.dumps({"role": msg["role"], "content": msg["content"]}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _open(self, user_id):
+        # Caller holds the user's lock; a handle is only used, replaced or closed under it
+        with self._lock:
+            f = self._files.get(user_id)
+            if f is not None:
+                self._files.move_to_end(user_id)
+        if f is not None and self.shared and self._replaced(user_id, f):
+            # Another process compacted the file; our handle still points at the old one
+            self._close(user_id)
+            f = None
+        if f is not None:
+            return f
+
+        self._migrate_legacy(user_id)
+        f = open(self.path(user_id), "ab")
+        # A crash mid-write can leave a torn last line; never glue new records onto it
+        if f.tell() > 0:
+            with open(self.path(user_id), "rb") as r:
+                r.seek(-1, os.SEEK_END)
+                if r.read(1) != b"\n":
+                    f.write(b"\n")
+                    self._needs_compaction.add(user_id)
+        with self._lock:
+            self._files[user_id] = f
+            self._last_sync.setdefault(user_id, time.monotonic())
+        self._evict(user_id)
+        return f
+
+    def _evict(self, keep):
+        # Close the least recently used handles over MAX_OPEN_FILES whose users are not mid-write
+        while True:
+            with self._lock:
+                if len(self._files) <= MAX_OPEN_FILES:
+                    return
+                for old_id in self._files:
+                    lock = self._user_lock(old_id)
+                    if old_id != keep and lock.acquire(blocking=False):
+                        break
+                else:
+                    return  # all busy; try again on the next open
+            try:
+                self._close(old_id)
+            finally:
+                lock.release()
+
+    def _close(self, user_id):
+        with self._lock:
+            f = self._files.pop(user_id, None)
+        if f is not None:
+            self._sync(user_id, f)
+            f.close()
+
+    def _replaced(self, user_id, f):
+        try:
+            return os.stat(self.path(user_id)).st_ino != os.fstat(f.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _sync(self, user_id, f):
+        # Caller holds the user's lock, not the handle table's
+        if self._unsynced.get(user_id):
+            f.flush()
+            os.fsync(f.fileno())
+            self._unsynced[user_id] = 0
+        self._last_sync[user_id] = time.monotonic()
+
+    def append(self, user_id, messages):
+        now = time.time()
+        self._write(user_id, [{"role": m["role"], "content": m["content"], "ts": now} for m in messages])
+
+    def append_digest(self, user_id, content, kept):
+        """Record a digest of every message before the last `kept` ones; read_tail stops at it."""
+        self._write(user_id, [{"role": DIGEST_ROLE, "content": content, "kept": kept, "ts": time.time()}])
+
+    def _write(self, user_id, records):
+        data = b"".join(json.dumps(record).encode("utf-8") + b"\n" for record in records)
+        with self._user_lock(user_id):
+            f = self._open(user_id)
+            f.write(data)
+            f.flush()
+            self._unsynced[user_id] = self._unsynced.get(user_id, 0) + len(records)
+            if (self._unsynced[user_id] >= self.fsync_batch
+                    or time.monotonic() - self._last_sync[user_id] >= self.fsync_interval):
+                self._sync(user_id, f)
+            if user_id in self._needs_compaction:
+                self._compact(user_id)
+
+    def flush(self):
+        with self._lock:
+            user_ids = list(self._files)
+        for user_id in user_ids:
+            with self._user_lock(user_id):
+                f = self._files.get(user_id)
+                if f is not None:
+                    self._sync(user_id, f)
+
+    def close(self):
+        with self._lock:
+            user_ids = list(self._files)
+        for user_id in user_ids:
+            with self._user_lock(user_id):
+                self._close(user_id)
+
+    ### ---- Reading ---- ###
+    def _iter_reverse(self, user_id, before=None):
+        # Yields (offset, record) newest first, for records starting before `before`
+        with self._user_lock(user_id):
+            self._migrate_legacy(user_id)
+        path = self.path(user_id)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            pos = os.fstat(f.fileno()).st_size if before is None else before
+            tail = b""
+            while pos > 0:
+                size = min(READ_BLOCK_SIZE, pos)
+                pos -= size
+                f.seek(pos)
+                buf = f.read(size) + tail
+                lines = buf.split(b"\n")
+                tail = lines[0]
+                cursor = pos + len(buf)
+                for line in reversed(lines[1:]):
+                    start = cursor - len(line)
+                    cursor = start - 1
+                    record = self._parse(user_id, line)
+                    if record is not None:
+                        yield start, record
+            record = self._parse(user_id, tail)
+            if record is not None:
+                yield 0, record
+
+    def _parse(self, user_id, line):
+        if not line.strip():
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError:
+            self._needs_compaction.add(user_id)
+            return None
+        if record.get("role") not in ("user", "assistant", DIGEST_ROLE):
+            return None
+        return record
+
+    def read_tail(self, user_id, budget, cost):
+        """Newest messages whose summed `cost` fits in `budget`, oldest first,
+        as (message, cost) pairs plus the offset to page back from.
+
+        Reading stops at the newest digest record, which comes back first as a
+        system message standing in for everything it summarized."""
+        picked = []
+        used = 0
+        oldest = None
+        digest = None
+        remaining = None    # messages still to read once a digest was found
+        for offset, record in self._iter_reverse(user_id):
+            if record["role"] == DIGEST_ROLE:
+                if digest is None:
+                    digest = {"role": "system", "content": record["content"]}
+                    remaining = record.get("kept", 0)
+                continue
+            if remaining == 0:
+                break
+            message = {"role": record["role"], "content": record["content"]}
+            tokens = cost(message)
+            if used + tokens > budget:
+                digest = None  # it summarizes messages older than the ones that did not fit
+                break
+            used += tokens
+            picked.append((message, tokens))
+            oldest = offset
+            if remaining is not None:
+                remaining -= 1
+        if digest is not None:
+            tokens = cost(digest)
+            if used + tokens <= budget:
+                picked.append((digest, tokens))
+        picked.reverse()
+        if oldest is None:
+            oldest = self.size(user_id)
+        return picked, oldest
+
+    def read_page(self, user_id, before, limit):
+        """Up to `limit` messages that start before byte offset `before`,
+        oldest first, plus the offset to continue paging from."""
+        page = []
+        oldest = before
+        for offset, record in self._iter_reverse(user_id, before):
+            if record["role"] == DIGEST_ROLE:
+                continue
+            page.append({"role": record["role"], "content": record["content"]})
+            oldest = offset
+            if len(page) >= limit:
+                break
+        else:
+            oldest = 0
+        page.reverse()
+        return page, oldest
+
+    def size(self, user_id):
+        try:
+            return os.path.getsize(self.path(user_id))
+        except OSError:
+            return 0
+
+    def version(self, user_id):
+        # Changes whenever anyone appends to or compacts the transcript
+        try:
+            st = os.stat(self.path(user_id))
+        except OSError:
+            return None
+        return st.st_ino, st.st_size
+
+    ### ---- Compaction ---- ###
+    def _compact(self, user_id):
+        # Rewrite the transcript without torn or unreadable lines, then swap it in atomically.
+        # Caller holds the user's lock; the new inode makes the search index start this file over
+        self._close(user_id)
+
+        path = self.path(user_id)
+        if os.path.exists(path):
+            tmp = path + ".tmp"
+            with open(path, "rb") as src, open(tmp, "wb") as dst:
+                for line in src:
+                    line = line.rstrip(b"\n")
+                    if not line.strip():
+                        continue
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        continue
+                    dst.write(line + b"\n")
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp, path)
+
+        self._needs_compaction.discard(user_id)
@@ -0,0 +1,376 @@
+# upstream.py
+#
+# The layer between the chat server and the OpenAI API: a pooled HTTP client,
+# per-request timeouts, retries with jittered exponential backoff on 429/5xx,
+# a circuit breaker, optional hedged requests and rotation across API keys.
+# The openai package is only imported once the first request is made.
+# tests/test_upstream.py exercises each behaviour against fake_openai.py.
+
+import asyncio
+import random
+import threading
+import time
+
+### ---- Upstream Config ---- ###
+CONNECT_TIMEOUT = 5.0       # seconds to open a connection
+READ_TIMEOUT = 30.0         # seconds between streamed chunks
+REQUEST_TIMEOUT = 60.0      # seconds until the first chunk of a reply, hedges included
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE = 20
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5          # seconds before the first retry, doubled for each one after
+BACKOFF_MAX = 8.0
+BREAKER_THRESHOLD = 5       # consecutive upstream failures that open the circuit
+BREAKER_COOLDOWN = 30.0     # seconds the circuit stays open before a trial request
+HEDGE_AFTER = 0.0           # seconds without a first chunk before a second request is sent, 0 = off
+KEY_COOLDOWN = 60.0         # seconds a rate-limited key is skipped when no Retry-After is given
+REJECTED_KEY_COOLDOWN = 3600.0
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def parse_keys(value):
+    # APIK may hold several keys separated by commas
+    return [key.strip() for key in value.split(",") if key.strip()]
+
+
+### ---- Errors ---- ###
+class UpstreamError(Exception):
+    """A request that failed for good; `user_message` is safe to show in the chat."""
+
+    def __init__(self, user_message, kind):
+        super().__init__(user_message)
+        self.user_message = user_message
+        self.kind = kind
+
+
+class _Failure:
+    # How one attempt failed: retry it?, count it against the breaker?, wait at least this long
+    def __init__(self, kind, retry, upstream_fault, retry_after=None):
+        self.kind = kind
+        self.retry = retry
+        self.upstream_fault = upstream_fault
+        self.retry_after = retry_after
+
+
+def classify(error):
+    import openai
+    if isinstance(error, asyncio.TimeoutError):
+        return _Failure("timeout", True, True)
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return _Failure(type(error).__name__, True, True)
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        retry_after = None
+        try:
+            retry_after = float(error.response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+        if status in (401, 403):
+            return _Failure("rejected_key", True, False)  # another key may still work
+        return _Failure(f"http_{status}", status in RETRY_STATUSES, status >= 500, retry_after)
+    return _Failure(type(error).__name__, False, False)
+
+
+USER_MESSAGES = {
+    "circuit_open": "The assistant is temporarily unavailable. Please try again in a minute.",
+    "timeout": "The assistant took too long to answer. Please try again.",
+    "http_429": "The assistant is very busy right now. Please try again in a moment.",
+    "interrupted": "The reply was interrupted. Please send your message again.",
+}
+DEFAULT_USER_MESSAGE = "The assistant could not answer right now. Please try again."
+
+
+### ---- Circuit Breaker ---- ###
+class CircuitBreaker:
+    """Fails fast after `threshold` consecutive upstream failures.
+
+    While open every request is refused; after `cooldown` seconds one trial
+    request is let through (half-open) and its outcome closes or reopens it."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self.opens = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """False to refuse, "trial" for the one half-open request, True otherwise."""
+        if not self.threshold:
+            return True
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return "trial"
+            return False
+
+    def abandon(self):
+        # The trial request ended without an outcome (cancelled); let the next request try instead
+        with self._lock:
+            self._trial = False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.threshold and self.failures >= self.threshold and self.opened_at is None):
+                if self.opened_at is None:
+                    self.opens += 1
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+### ---- API Keys ---- ###
+class KeyPool:
+    """Round-robin over API keys, skipping keys that were rate-limited or rejected."""
+
+    def __init__(self, keys):
+        if not keys:
+            raise ValueError("At least one API key is needed")
+        self.keys = list(keys)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._cooling = {}      # key -> monotonic time it may be used again
+
+    def next(self):
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.keys)):
+                key = self.keys[self._next % len(self.keys)]
+                self._next += 1
+                if self._cooling.get(key, 0) <= now:
+                    return key
+            # Every key is cooling down: use the one that recovers first rather than refusing
+            return min(self.keys, key=lambda k: self._cooling.get(k, 0))
+
+    def cool_down(self, key, seconds):
+        with self._lock:
+            self._cooling[key] = max(self._cooling.get(key, 0), time.monotonic() + seconds)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "keys": len(self.keys),
+            "cooling_down": sum(1 for until in self._cooling.values() if until > now),
+        }
+
+
+### ---- Upstream ---- ###
+class _Opened:
+    # A streaming response whose first chunk has already arrived
+    def __init__(self, stream, chunks, first):
+        self.stream = stream
+        self.chunks = chunks
+        self.first = first
+
+
+class Upstream:
+    """Sends chat completion requests with timeouts, retries, hedging and key rotation.
+
+    Retries only happen before the first chunk of a reply has been passed on,
+    so a user never sees a reply restart. All keys share one pooled HTTP
+    client; clients are created on first use."""
+
+    def __init__(self, api_keys, base_url=None, max_attempts=MAX_ATTEMPTS, request_timeout=REQUEST_TIMEOUT,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, hedge_after=HEDGE_AFTER,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, max_connections=MAX_CONNECTIONS,
+                 breaker=None, rng=None):
+        self.keys = KeyPool(api_keys)
+        self.base_url = base_url
+        self.max_attempts = max(1, max_attempts)
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.hedge_after = hedge_after
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        self.breaker = breaker or CircuitBreaker()
+        self.random = rng or random.Random()
+        self._clients = None    # key -> AsyncOpenAI
+        self._clients_lock = threading.Lock()
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = {}      # failure kind -> count
+
+    def clients(self):
+        if self._clients is None:
+            with self._clients_lock:
+                if self._clients is None:
+                    import openai  # slow to import, see startup.py
+                    # type() of the default keeps this working whichever httpx flavour openai uses
+                    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=min(MAX_KEEPALIVE, self.max_connections),
+                    )
+                    http_client = openai.DefaultAsyncHttpxClient(
+                        limits=limits,
+                        timeout=openai.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    )
+                    self._clients = {
+                        key: openai.AsyncOpenAI(api_key=key, base_url=self.base_url, http_client=http_client, max_retries=0)
+                        for key in self.keys.keys
+                    }
+        return self._clients
+
+    def _count_failure(self, kind):
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+
+    def backoff(self, attempt, retry_after=None):
+        # Full jitter keeps clients that failed together from retrying together
+        delay = self.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    ### ---- Single Attempts ---- ###
+    async def _open(self, key, params):
+        self.attempts += 1
+        try:
+            response = await self.clients()[key].chat.completions.create(**params)
+            if not params.get("stream"):
+                return response
+            chunks = response.__aiter__()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await response.close()
+                raise
+            return _Opened(response, chunks, first)
+        except Exception as e:
+            failure = classify(e)
+            if failure.kind == "rejected_key":
+                self.keys.cool_down(key, REJECTED_KEY_COOLDOWN)
+            elif failure.kind == "http_429":
+                self.keys.cool_down(key, failure.retry_after or KEY_COOLDOWN)
+            raise
+
+    async def _attempt(self, params):
+        """One attempt, hedged with a second request on the next key when the first is slow."""
+        tasks = [asyncio.create_task(self._open(self.keys.next(), params))]
+        winner = None
+        try:
+            if self.hedge_after:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    self.hedges += 1
+                    tasks.append(asyncio.create_task(self._open(self.keys.next(), params)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            for task in tasks:
+                if task is not winner:
+                    await _discard(task)
+
+    async def _call(self, params):
+        self.requests += 1
+        for attempt in range(1, self.max_attempts + 1):
+            allowed = self.breaker.allow()
+            if not allowed:
+                self._count_failure("circuit_open")
+                raise UpstreamError(USER_MESSAGES["circuit_open"], "circuit_open")
+            try:
+                result = await asyncio.wait_for(self._attempt(params), self.request_timeout)
+            except asyncio.CancelledError:
+                if allowed == "trial":
+                    self.breaker.abandon()
+                raise
+            except Exception as e:
+                failure = classify(e)
+                self._count_failure(failure.kind)
+                if failure.upstream_fault:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()  # upstream answered, it just refused this request
+                if not failure.retry or attempt == self.max_attempts:
+                    raise UpstreamError(USER_MESSAGES.get(failure.kind, DEFAULT_USER_MESSAGE), failure.kind) from e
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt, failure.retry_after))
+                continue
+            self.breaker.success()
+            return result
+
+    ### ---- Public API ---- ###
+    async def complete(self, **params):
+        """chat.completions.create without streaming; returns the ChatCompletion."""
+        return await self._call(dict(params, stream=False))
+
+    async def stream_chat(self, **params):
+        """Yields the chunks of a streamed chat completion."""
+        opened = await self._call(dict(params, stream=True))
+        try:
+            if opened.first is None:
+                return
+            yield opened.first
+            async for chunk in opened.chunks:
+                yield chunk
+        except Exception as e:
+            self._count_failure("interrupted")
+            if classify(e).upstream_fault:
+                self.breaker.failure()
+            raise UpstreamError(USER_MESSAGES["interrupted"], "interrupted") from e
+        finally:
+            await opened.stream.close()
+
+    def warm_up(self):
+        self.clients()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": dict(self.failures),
+            "circuit": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+            "api_keys": self.keys.stats(),
+        }
+
+
+async def _discard(task):
+    # A hedge that lost must not keep its connection open
+    try:
+        result = await task
+    except BaseException:
+        return
+    if isinstance(result, _Opened):
+        await result.stream.close()
+
@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+from datetime import date
+
+### ---- Ledger Config ---- ###
+USAGE_FILE = "usage.db"
+FLUSH_INTERVAL = 5.0        # seconds between write-behind flushes
+
+
+### ---- Usage Ledger ---- ###
+class UsageLedger:
+    """Write-behind ledger of the tokens OpenAI reports for each request.
+
+    record() only touches memory. A background thread flushes the pending
+    counts every `flush_interval` seconds (and close() does a final flush):
+    per-user, per-day rows go to a SQLite table and each user's total is
+    added to the user store in one batch. `on_flushed(totals)` receives the
+    new stored totals so in-memory user records can follow along."""
+
+    def __init__(self, path=USAGE_FILE, store=None, on_flushed=None, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.store = store
+        self.on_flushed = on_flushed
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}      # (user_id, day) -> [prompt_tokens, completion_tokens, requests]
+        self._unflushed = {}    # user_id -> tokens recorded but not yet in the user store
+        self._store_retry = {}  # user_id -> tokens already in usage_daily whose store write failed
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.recorded_tokens = 0
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage_daily (
+                    user_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, day)
+                )
+            """)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Usage flush failed, will retry: {e}")
+
+    ### ---- Recording ---- ###
+    def record(self, user_id, prompt_tokens, completion_tokens):
+        key = (user_id, date.today().isoformat())
+        tokens = prompt_tokens + completion_tokens
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = [0, 0, 0]
+            entry[0] += prompt_tokens
+            entry[1] += completion_tokens
+            entry[2] += 1
+            self._unflushed[user_id] = self._unflushed.get(user_id, 0) + tokens
+            self.recorded_tokens += tokens
+
+    def unflushed(self, user_id):
+        # Tokens used since the last flush; add to the stored total for a current figure
+        return self._unflushed.get(user_id, 0)
+
+    ### ---- Flushing ---- ###
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending and not self._store_retry:
+                return 0
+
+            if pending:
+                try:
+                    with self._conn:
+                        self._conn.executemany(
+                            "INSERT INTO usage_daily VALUES (?, ?, ?, ?, ?) "
+                            "ON CONFLICT(user_id, day) DO UPDATE SET "
+                            "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                            "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                            "requests = requests + excluded.requests",
+                            [(user_id, day, *counts) for (user_id, day), counts in pending.items()],
+                        )
+                except sqlite3.Error:
+                    self._requeue(pending)
+                    raise
+
+            # Daily rows are written; the store totals (plus any that failed last time) go next
+            with self._lock:
+                totals, self._store_retry = self._store_retry, {}
+            for (user_id, _), (prompt_tokens, completion_tokens, _) in pending.items():
+                totals[user_id] = totals.get(user_id, 0) + prompt_tokens + completion_tokens
+            if self.store is not None:
+                try:
+                    stored = self.store.add_used_tokens_many(totals)
+                except Exception:
+                    with self._lock:
+                        for user_id, tokens in totals.items():
+                            self._store_retry[user_id] = self._store_retry.get(user_id, 0) + tokens
+                    raise
+                if self.on_flushed is not None:
+                    self.on_flushed(stored)
+
+            # Only now stop counting these as unflushed, so readers never see them missing
+            with self._lock:
+                for user_id, tokens in totals.items():
+                    left = self._unflushed.get(user_id, 0) - tokens
+                    if left > 0:
+                        self._unflushed[user_id] = left
+                    else:
+                        self._unflushed.pop(user_id, None)
+            self.flushes += 1
+            return len(pending) or len(totals)
+
+    def _requeue(self, pending):
+        with self._lock:
+            for key, counts in pending.items():
+                entry = self._pending.setdefault(key, [0, 0, 0])
+                for i, value in enumerate(counts):
+                    entry[i] += value
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    ### ---- Reporting ---- ###
+    def stats(self):
+        today = date.today().isoformat()
+        with self._flush_lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0) "
+                "FROM usage_daily WHERE day = ?",
+                (today,),
+            ).fetchone()
+        return {
+            "pending_users": len(self._unflushed),
+            "recorded_tokens": self.recorded_tokens,
+            "flushes": self.flushes,
+            "today": {"users": row[0], "prompt_tokens": row[1], "completion_tokens": row[2]},
+        }
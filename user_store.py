@@ -0,0 +1,397 @@
+import json
+import os
+import sqlite3
+import threading
+from filelock import FileLock
+
+### ---- Store Config ---- ###
+# USER_STORE is "<backend>:<path>", e.g. "sqlite:users.db" or "json:config.json"
+DEFAULT_USER_STORE = "sqlite:users.db"
+LEGACY_CONFIG_FILE = "config.json"
+
+COLUMNS = ("token", "role", "active", "used_tokens", "max_tokens", "createdDate")
+ROW_COLUMNS = ("user_id", *COLUMNS, "extra", "changed_seq")
+SORT_FIELDS = ("user_id", "used_tokens", "max_tokens", "usage_ratio", "createdDate")
+
+
+class UserQuery:
+    """Filter, sort and page settings for the admin user table."""
+
+    def __init__(self, active=None, search=None, min_usage=None, created_from=None, created_to=None,
+                 sort="user_id", descending=False, offset=0, limit=50, default_max_tokens=128_000, default_usage_quota=0):
+        self.active = active                # None for all, else True/False
+        self.search = search                # substring of the user id
+        self.min_usage = min_usage          # used_tokens / usage_quota at least this; unlimited users never match
+        self.created_from = created_from    # "YYYY-MM-DD", inclusive
+        self.created_to = created_to        # "YYYY-MM-DD", inclusive
+        self.sort = sort if sort in SORT_FIELDS else "user_id"
+        self.descending = descending
+        self.offset = max(0, int(offset))
+        self.limit = max(1, int(limit))
+        self.default_max_tokens = default_max_tokens
+        self.default_usage_quota = default_usage_quota
+
+    def usage_ratio(self, record):
+        # None for users without a quota
+        quota = record.get("usage_quota", self.default_usage_quota)
+        return record.get("used_tokens", 0) / quota if quota else None
+
+    def matches(self, user_id, record):
+        if record.get("role") == "admin":
+            return False
+        if self.active is not None and bool(record.get("active", True)) != self.active:
+            return False
+        if self.search and self.search.lower() not in user_id.lower():
+            return False
+        if self.min_usage is not None:
+            ratio = self.usage_ratio(record)
+            if ratio is None or ratio < self.min_usage:
+                return False
+        created = record.get("createdDate") or ""
+        if self.created_from and created[:10] < self.created_from:
+            return False
+        if self.created_to and created[:10] > self.created_to:
+            return False
+        return True
+
+    def sort_key(self, item):
+        user_id, record = item
+        if self.sort == "user_id":
+            return user_id
+        if self.sort == "usage_ratio":
+            ratio = self.usage_ratio(record)
+            return -1.0 if ratio is None else ratio  # unlimited first, like SQL NULLs
+        if self.sort == "max_tokens":
+            return record.get("max_tokens") or self.default_max_tokens
+        if self.sort == "createdDate":
+            return record.get("createdDate") or ""
+        return record.get(self.sort, 0)
+
+    def run(self, users):
+        # In-memory fallback for backends without a query engine
+        matched = [item for item in users.items() if self.matches(*item)]
+        matched.sort(key=self.sort_key, reverse=self.descending)
+        return matched[self.offset:self.offset + self.limit], len(matched)
+
+
+### ---- JSON Backend ---- ###
+class JsonUserStore:
+    """The original whole-file config.json store, kept for small deployments."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = FileLock(path + ".lock")
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _write(self, users):
+        with open(self.path, "w") as f:
+            json.dump(users, f, indent=2)
+
+    def load_all(self):
+        return self._read()
+
+    def version(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, user_id):
+        return self._read().get(user_id)
+
+    def user_ids(self):
+        return set(self._read())
+
+    def save_all(self, users):
+        with self.lock:
+            self._write(users)
+
+    def insert_many(self, users):
+        with self.lock:
+            data = self._read()
+            data.update(users)
+            self._write(data)
+
+    def update(self, user_id, **fields):
+        with self.lock:
+            data = self._read()
+            if user_id not in data:
+                return False
+            data[user_id].update(fields)
+            self._write(data)
+            return True
+
+    def query(self, query):
+        return query.run(self._read())
+
+    def add_used_tokens(self, user_id, tokens):
+        with self.lock:
+            data = self._read()
+            if user_id not in data:
+                return None
+            user = data[user_id]
+            user["used_tokens"] = user.get("used_tokens", 0) + tokens
+            self._write(data)
+            return user["used_tokens"]
+
+    def add_used_tokens_many(self, deltas):
+        with self.lock:
+            data = self._read()
+            totals = {}
+            for user_id, tokens in deltas.items():
+                if user_id in data:
+                    user = data[user_id]
+                    user["used_tokens"] = totals[user_id] = user.get("used_tokens", 0) + tokens
+            self._write(data)
+            return totals
+
+
+### ---- SQLite Backend ---- ###
+class SqliteUserStore:
+    """One row per user in a WAL-mode SQLite database, so per-turn writes
+    touch a single row instead of rewriting every user.
+
+    Every insert or update (except used_tokens increments) bumps the store's
+    version and stamps the rows it wrote with it, so readers holding an older
+    version fetch just those rows with changes_since()."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    token TEXT,
+                    role TEXT NOT NULL DEFAULT 'user',
+                    active INTEGER NOT NULL DEFAULT 1,
+                    used_tokens INTEGER NOT NULL DEFAULT 0,
+                    max_tokens INTEGER,
+                    createdDate TEXT,
+                    extra TEXT,
+                    changed_seq INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            if "changed_seq" not in {row["name"] for row in conn.execute("PRAGMA table_info(users)")}:
+                conn.execute("ALTER TABLE users ADD COLUMN changed_seq INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS users_used_tokens ON users (used_tokens)")
+            conn.execute("CREATE INDEX IF NOT EXISTS users_created ON users (createdDate)")
+            conn.execute("CREATE INDEX IF NOT EXISTS users_changed ON users (changed_seq)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_record(row):
+        record = json.loads(row["extra"]) if row["extra"] else {}
+        record.update({
+            "token": row["token"],
+            "role": row["role"],
+            "active": bool(row["active"]),
+            "used_tokens": row["used_tokens"],
+        })
+        if row["max_tokens"] is not None:
+            record["max_tokens"] = row["max_tokens"]
+        if row["createdDate"] is not None:
+            record["createdDate"] = row["createdDate"]
+        return record
+
+    @staticmethod
+    def _to_row(user_id, record, seq):
+        extra = {k: v for k, v in record.items() if k not in COLUMNS}
+        return (
+            user_id,
+            record.get("token"),
+            record.get("role", "user"),
+            int(bool(record.get("active", True))),
+            int(record.get("used_tokens", 0)),
+            record.get("max_tokens"),
+            record.get("createdDate"),
+            json.dumps(extra) if extra else None,
+            seq,
+        )
+
+    def load_all(self):
+        rows = self._conn().execute("SELECT * FROM users")
+        return {row["user_id"]: self._to_record(row) for row in rows}
+
+    def version(self):
+        # Bumped by every insert/update except used_tokens increments, which change every turn
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'users_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def changes_since(self, version):
+        """(current version, {user_id: record}) for the rows written after `version`."""
+        conn = self._conn()
+        with conn:  # one read transaction, so the rows and the version agree
+            conn.execute("BEGIN")
+            current = self.version()
+            rows = conn.execute("SELECT * FROM users WHERE changed_seq > ?", (version or 0,))
+            return current, {row["user_id"]: self._to_record(row) for row in rows}
+
+    @staticmethod
+    def _bump_version(conn):
+        # Returns the new version, which the caller stamps on the rows it writes
+        return int(conn.execute(
+            "INSERT INTO meta VALUES ('users_version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 RETURNING value"
+        ).fetchone()[0])
+
+    def get(self, user_id):
+        row = self._conn().execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return self._to_record(row) if row else None
+
+    def user_ids(self):
+        return {row[0] for row in self._conn().execute("SELECT user_id FROM users")}
+
+    def save_all(self, users):
+        self.insert_many(users)
+
+    def insert_many(self, users):
+        with self._conn() as conn:
+            seq = self._bump_version(conn)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO users ({', '.join(ROW_COLUMNS)}) VALUES ({', '.join('?' * len(ROW_COLUMNS))})",
+                (self._to_row(uid, record, seq) for uid, record in users.items()),
+            )
+
+    def update(self, user_id, **fields):
+        columns = {k: v for k, v in fields.items() if k in COLUMNS}
+        extra = {k: v for k, v in fields.items() if k not in COLUMNS}
+        if "active" in columns:
+            columns["active"] = int(bool(columns["active"]))
+
+        with self._conn() as conn:
+            if extra:
+                row = conn.execute("SELECT extra FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                if row is None:
+                    return False
+                merged = json.loads(row["extra"]) if row["extra"] else {}
+                merged.update(extra)
+                columns["extra"] = json.dumps(merged)
+            if not columns:
+                return True
+            if set(columns) != {"used_tokens"}:
+                columns["changed_seq"] = self._bump_version(conn)
+            assignments = ", ".join(f"{name} = ?" for name in columns)
+            cur = conn.execute(
+                f"UPDATE users SET {assignments} WHERE user_id = ?",
+                (*columns.values(), user_id),
+            )
+            if cur.rowcount != 1:
+                conn.rollback()  # leave the version alone for an unknown user
+                return False
+            return True
+
+    def query(self, query):
+        where = ["role != 'admin'"]
+        params = []
+        ratio = "CAST(used_tokens AS REAL) / NULLIF(COALESCE(json_extract(extra, '$.usage_quota'), ?), 0)"
+        if query.active is not None:
+            where.append("active = ?")
+            params.append(int(query.active))
+        if query.search:
+            where.append("user_id LIKE ? ESCAPE '\\'")
+            escaped = query.search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if query.min_usage is not None:
+            where.append(f"{ratio} >= ?")
+            params += [query.default_usage_quota, query.min_usage]
+        if query.created_from:
+            where.append("substr(createdDate, 1, 10) >= ?")
+            params.append(query.created_from)
+        if query.created_to:
+            where.append("substr(createdDate, 1, 10) <= ?")
+            params.append(query.created_to)
+        clause = " AND ".join(where)
+
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM users WHERE {clause}", params).fetchone()[0]
+
+        order_params = []
+        if query.sort == "usage_ratio":
+            order = ratio
+            order_params.append(query.default_usage_quota)
+        elif query.sort == "max_tokens":
+            order = "COALESCE(max_tokens, ?)"
+            order_params.append(query.default_max_tokens)
+        else:
+            order = query.sort
+        direction = "DESC" if query.descending else "ASC"
+        rows = conn.execute(
+            f"SELECT * FROM users WHERE {clause} ORDER BY {order} {direction}, user_id LIMIT ? OFFSET ?",
+            params + order_params + [query.limit, query.offset],
+        )
+        return [(row["user_id"], self._to_record(row)) for row in rows], total
+
+    def add_used_tokens(self, user_id, tokens):
+        with self._conn() as conn:
+            row = conn.execute(
+                "UPDATE users SET used_tokens = used_tokens + ? WHERE user_id = ? RETURNING used_tokens",
+                (tokens, user_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_used_tokens_many(self, deltas):
+        # One transaction for a whole ledger flush; returns the new totals
+        totals = {}
+        with self._conn() as conn:
+            for user_id, tokens in deltas.items():
+                row = conn.execute(
+                    "UPDATE users SET used_tokens = used_tokens + ? WHERE user_id = ? RETURNING used_tokens",
+                    (tokens, user_id),
+                ).fetchone()
+                if row:
+                    totals[user_id] = row[0]
+        return totals
+
+    def migrate_from_json(self, json_path=LEGACY_CONFIG_FILE):
+        # One-shot: import config.json into an empty store and remember that we did
+        conn = self._conn()
+        if conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+            return 0
+        if not os.path.exists(json_path):
+            return 0
+        if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return 0
+
+        with open(json_path, "r") as f:
+            users = json.load(f)
+        self.insert_many(users)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from', ?)", (json_path,))
+        return len(users)
+
+
+### ---- Factory ---- ###
+def open_user_store(url=None, migrate=True):
+    url = url or os.environ.get("USER_STORE", DEFAULT_USER_STORE)
+    backend, _, path = url.partition(":")
+    if backend == "json":
+        return JsonUserStore(path or LEGACY_CONFIG_FILE)
+    if backend == "sqlite":
+        store = SqliteUserStore(path or "users.db")
+        if migrate:
+            migrated = store.migrate_from_json()
+            if migrated:
+                print(f"✅ Migrated {migrated} users from {LEGACY_CONFIG_FILE} into {store.path}")
+        return store
+    raise ValueError(f"Unknown user store backend: {backend!r}")
+
+
+if __name__ == "__main__":
+    open_user_store()